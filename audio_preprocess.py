@@ -0,0 +1,113 @@
+import io
+import wave
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+# ---------------------------
+# Audio preprocessing before upload
+# ---------------------------
+# Speech needs far less than what the recorder captures. Before audio is sent to
+# Gemini it is downmixed to mono, resampled to 16 kHz and has long pauses shortened,
+# which alone shrinks a stereo 44.1 kHz recording ~5x; FLAC/Ogg encoding (needs the
+# optional soundfile package) roughly halves it again. Everything here is plain
+# NumPy with no Streamlit imports, so it can run in a worker process.
+
+TARGET_SAMPLE_RATE = 16000
+SILENCE_WINDOW_SEC = 0.03
+SILENCE_THRESHOLD_DBFS = -45.0   # windows quieter than this (or near the noise floor) count as silence
+SILENCE_KEEP_SEC = 0.4           # pauses longer than this are cut down to this length
+
+CODEC_MIME_TYPES = {"wav": "audio/wav", "flac": "audio/flac", "ogg": "audio/ogg"}
+
+
+def mono_samples(params: wave._wave_params, frames: bytes) -> np.ndarray:
+    """Mono float samples in [-1, 1] (channels averaged)."""
+    dtype = {1: np.uint8, 2: np.int16, 4: np.int32}.get(params.sampwidth)
+    if dtype is None:
+        raise ValueError(f"Unsupported sample width: {params.sampwidth}")
+    data = np.frombuffer(frames, dtype=dtype).astype(np.float32)
+    if params.sampwidth == 1:
+        data = (data - 128.0) / 128.0
+    else:
+        data /= float(2 ** (8 * params.sampwidth - 1))
+    return data.reshape(-1, params.nchannels).mean(axis=1)
+
+def resample(samples: np.ndarray, rate: int, target_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """Linear-interpolation resample, with a box filter first when downsampling."""
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    ratio = rate / target_rate
+    if ratio >= 2:
+        width = int(ratio)
+        samples = np.convolve(samples, np.full(width, 1.0 / width, dtype=np.float32), mode="same")
+    n_out = int(len(samples) / ratio)
+    positions = np.arange(n_out, dtype=np.float64) * ratio
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+def trim_silence(samples: np.ndarray, rate: int) -> np.ndarray:
+    """Drop leading/trailing silence and shorten long pauses to SILENCE_KEEP_SEC."""
+    window = max(1, int(rate * SILENCE_WINDOW_SEC))
+    usable = len(samples) // window * window
+    if usable == 0:
+        return samples
+    blocks = samples[:usable].reshape(-1, window)
+    rms = np.sqrt(np.mean(blocks ** 2, axis=1))
+    # Twice the noise floor, but never above a tenth of the loudest window, so a clip
+    # of continuous speech (whose 10th percentile is speech) isn't trimmed as silence
+    noise_floor = np.percentile(rms, 10)
+    threshold = max(10 ** (SILENCE_THRESHOLD_DBFS / 20), min(noise_floor * 2, rms.max() * 0.1))
+    voiced = rms > threshold
+    if not voiced.any():
+        return samples[:0]
+
+    # Keep voiced windows plus up to keep_windows of each pause, split around the voice
+    keep_windows = max(1, int(SILENCE_KEEP_SEC / SILENCE_WINDOW_SEC))
+    idx = np.arange(len(voiced))
+    last_voiced = np.maximum.accumulate(np.where(voiced, idx, -10 ** 9))
+    next_voiced = np.minimum.accumulate(np.where(voiced, idx, 10 ** 9)[::-1])[::-1]
+    keep = voiced | ((idx - last_voiced) <= keep_windows // 2) | ((next_voiced - idx) <= keep_windows // 2)
+    return blocks[keep].reshape(-1)
+
+def encode(samples: np.ndarray, rate: int, codec: str = "wav") -> Tuple[bytes, str]:
+    """16-bit PCM in the requested container; falls back to WAV if soundfile is missing."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    if codec in ("flac", "ogg"):
+        try:
+            import soundfile
+            buf = io.BytesIO()
+            soundfile.write(buf, np.clip(samples, -1.0, 1.0), rate, format=codec.upper())
+            return buf.getvalue(), CODEC_MIME_TYPES[codec]
+        except ImportError:
+            pass
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue(), CODEC_MIME_TYPES["wav"]
+
+def preprocess_wav(wav_bytes: bytes, target_rate: int = TARGET_SAMPLE_RATE, trim: bool = True,
+                   codec: Optional[str] = None) -> Tuple[bytes, str, Dict[str, Any]]:
+    """Downmix, resample, trim and encode a WAV clip.
+
+    Returns (audio_bytes, mime_type, stats); stats has input/output bytes and seconds.
+    """
+    with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+        params = w.getparams()
+        frames = w.readframes(w.getnframes())
+    target_rate = min(target_rate, params.framerate)   # never upsample
+    samples = resample(mono_samples(params, frames), params.framerate, target_rate)
+    input_sec = params.nframes / params.framerate if params.framerate else 0.0
+    if trim:
+        samples = trim_silence(samples, target_rate)
+    audio_bytes, mime_type = encode(samples, target_rate, codec or "wav")
+    stats = {
+        "input_bytes": len(wav_bytes),
+        "output_bytes": len(audio_bytes),
+        "input_sec": round(input_sec, 2),
+        "output_sec": round(len(samples) / target_rate, 2),
+        "mime_type": mime_type,
+    }
+    return audio_bytes, mime_type, stats
@@ -0,0 +1,516 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+from google.api_core import exceptions as api_exceptions
+
+from gemini_clients import get_gemini_clients
+from grading import PREFIX_VERSION, get_grading_front, grade_fingerprint, grade_once, grade_provenance, submission_key
+from storage import StorageBackend, get_storage
+
+# ---------------------------
+# Offline bulk regrading
+# ---------------------------
+# Regrades the submissions table with the current rubric and prompt, page by page
+# (newest first, keyset-paged like the admin pages) on a bounded worker pool. Model
+# calls share a token bucket so a run stays under the key's rate limit; transient
+# API errors are retried with capped, jittered backoff. Progress is checkpointed to
+# a JSON file after every write, so an interrupted run resumes where it stopped.
+# Each regraded row keeps the text it replaced under grade_json.previous.
+#
+# By default a run is incremental: rows whose grade already carries the current
+# fingerprint (rubric, prompt template, model; see grading.py) with no concepts left
+# "Not graded" are skipped, as are instructor-edited grades, and a stale row whose
+# inputs already have a complete grade under the current fingerprint (a
+# resubmission) reuses that result. The table itself is the index of computed
+# results, read once at the start of a run.
+#
+# Run it from the admin "Regrade" page or from a shell:
+#     python bulk_regrade.py --rate 60 --workers 8          # stale rows only
+#     python bulk_regrade.py --all                          # every row
+# Against Supabase the shell run writes with the anon key, so the submissions
+# table's policies must allow it; the admin page writes as the signed-in admin.
+
+REGRADE_COLUMNS = "id, student_name, transcript_text, student_prompt, grade_json, created_at"
+INDEX_PAGE_SIZE = 500
+DEFAULT_CHECKPOINT_PATH = os.path.join(".data", "regrade_checkpoint.json")
+DEFAULT_RATE_PER_MIN = 60
+DEFAULT_WORKERS = 8
+PAGE_SIZE = 50
+WRITE_BATCH_SIZE = 10
+MAX_ATTEMPTS = 5
+RETRY_BASE_SEC = 2.0
+RETRY_MAX_SEC = 60.0
+MAX_CONSECUTIVE_FAILURES = 10   # something systemic (bad key, quota gone): stop instead of failing every row
+
+RETRYABLE_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+def _backoff(attempt: int) -> float:
+    """Capped exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_MAX_SEC, RETRY_BASE_SEC * (2 ** attempt)))
+
+def is_stale(grade: Any) -> bool:
+    """Whether an incremental run regrades this grade_json: ungraded, partly graded (concepts
+    left "Not graded" by per-concept grading), or graded under another fingerprint.
+
+    Plain-text grades are instructor edits and are left alone.
+    """
+    if isinstance(grade, str) and grade.strip():
+        return False
+    if isinstance(grade, dict) and grade.get("ungraded"):
+        return True
+    return grade_fingerprint(grade) != PREFIX_VERSION
+
+def _outcome(grade: Dict[str, Any]) -> str:
+    """RegradeStats category of a regraded grade_json, from where its text came from."""
+    return {"rule": "local", "memo": "local", "reused": "reused"}.get(grade.get("source"), "graded")
+
+def _previous_text(grade: Any) -> Optional[str]:
+    # Instructor edits are stored as plain text, model grades as {"text", ...}
+    if isinstance(grade, dict):
+        return grade.get("text")
+    return grade
+
+
+class TokenBucket:
+    """Blocking token bucket: rate_per_sec on average, bursts of up to capacity."""
+
+    def __init__(self, rate_per_sec: float, capacity: float = 1.0):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """Take one token, waiting as needed. False if stop was set while waiting."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                delay = (1 - self._tokens) / self.rate_per_sec
+            if stop is None:
+                time.sleep(delay)
+            elif stop.wait(delay):
+                return False
+
+
+class RegradeCheckpoint:
+    """Resume point of a run, kept in a small JSON file replaced atomically on save."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Dict[str, Any] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+        if not self.state:
+            self.reset()
+
+    def reset(self, stale_only: bool = True) -> None:
+        self.state = {
+            "run_id": uuid.uuid4().hex,
+            "prompt_version": PREFIX_VERSION,
+            "stale_only": stale_only,
+            "page_cursor": None,    # cursor of the page in progress (None = first page)
+            "done_ids": [],         # rows of that page already written
+            "failed": {},           # id -> error, for rows that ran out of attempts
+            "totals": {"processed": 0, "graded": 0, "local": 0, "reused": 0, "failed": 0, "skipped": 0},
+            "finished": False,
+        }
+
+    @property
+    def has_progress(self) -> bool:
+        """Whether a run has done anything worth resuming."""
+        return bool(self.state["page_cursor"] is not None or self.state["done_ids"] or self.state["failed"]
+                    or any(self.state["totals"].values()))
+
+    @property
+    def cursor(self):
+        cursor = self.state["page_cursor"]
+        return tuple(cursor) if cursor is not None else None
+
+    def page_done(self, next_cursor) -> None:
+        self.state["page_cursor"] = list(next_cursor) if next_cursor is not None else None
+        self.state["done_ids"] = []
+        self.state["finished"] = next_cursor is None
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+class RegradeStats:
+    """Counters and model-call latencies for the current run."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.processed = self.graded = self.local = self.reused = self.failed = self.retries = 0
+        self.skipped = 0
+        self._latencies_ms: List[float] = []
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str, latency_ms: Optional[float] = None) -> None:
+        with self._lock:
+            self.processed += 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if latency_ms is not None:
+                self._latencies_ms.append(latency_ms)
+
+    def skip(self, n: int) -> None:
+        with self._lock:
+            self.skipped += n
+
+    def retried(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            latencies = sorted(self._latencies_ms)
+
+            def pct(p: float) -> Optional[int]:
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))]) if latencies else None
+
+            return {
+                "processed": self.processed, "graded": self.graded, "local": self.local,
+                "reused": self.reused, "skipped": self.skipped, "failed": self.failed, "retries": self.retries,
+                "elapsed_sec": round(elapsed, 1),
+                "per_min": round(self.processed / elapsed * 60, 1) if elapsed > 0 else 0.0,
+                "latency_p50_ms": pct(0.5), "latency_p95_ms": pct(0.95),
+            }
+
+
+class BulkRegrade:
+    """One regrade run over the submissions table, resumable from its checkpoint file."""
+
+    def __init__(self, storage: StorageBackend, clients, checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+                 rate_per_min: float = DEFAULT_RATE_PER_MIN, workers: int = DEFAULT_WORKERS,
+                 page_size: int = PAGE_SIZE, max_attempts: int = MAX_ATTEMPTS, restart: bool = False,
+                 stale_only: bool = True):
+        self.storage = storage
+        self.clients = clients
+        self.workers = workers
+        self.page_size = page_size
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate_per_min / 60.0, capacity=min(workers, max(1.0, rate_per_min / 60.0)))
+        self.checkpoint = RegradeCheckpoint(checkpoint_path)
+        if restart or self.checkpoint.state.get("finished") or not self.checkpoint.has_progress:
+            self.checkpoint.reset(stale_only)
+        elif self.checkpoint.state.get("prompt_version") != PREFIX_VERSION:
+            raise ValueError("The rubric or grading prompt changed since this run was checkpointed; "
+                             "restart the run to regrade with the current version.")
+        elif self.checkpoint.state.get("stale_only", True) != stale_only:
+            scope = "only stale rows" if self.checkpoint.state.get("stale_only", True) else "every row"
+            raise ValueError(f"The unfinished run regrades {scope}; resume it the same way or restart.")
+        self.stale_only = stale_only
+        self._results: Dict[str, str] = {}   # input_key -> grade text under the current fingerprint
+        self.stats = RegradeStats()
+        self._lock = threading.Lock()
+        self._failure_streak: List[Any] = []
+        self.aborted: Optional[str] = None
+
+    def _grade(self, row: Dict[str, Any], stop: threading.Event) -> Optional[Dict[str, Any]]:
+        """grade_json for row (None if stopped first). Raises once attempts run out."""
+        thoughts = row.get("transcript_text") or ""
+        final_prompt = row.get("student_prompt") or ""
+        local = get_grading_front().lookup(thoughts, final_prompt, count=False)   # RegradeStats counts these
+        if local:
+            self.stats.record("local")
+            return {"text": local["text"], "source": local["source"], **grade_provenance(thoughts, final_prompt)}
+        with self._lock:
+            known = self._results.get(submission_key(thoughts, final_prompt))
+        if known is not None:
+            self.stats.record("reused")
+            return {"text": known, "source": "reused", **grade_provenance(thoughts, final_prompt)}
+        for attempt in range(self.max_attempts):
+            if not self.bucket.acquire(stop):
+                return None
+            try:
+                grade = grade_once(self.clients, thoughts, final_prompt)
+            except RETRYABLE_ERRORS:
+                if attempt == self.max_attempts - 1:
+                    raise
+                self.stats.retried()
+                if stop.wait(_backoff(attempt)):
+                    return None
+                continue
+            self.stats.record("graded", grade["timing"]["total_ms"])
+            get_grading_front().remember(thoughts, final_prompt, grade["text"])
+            with self._lock:
+                self._results[grade["input_key"]] = grade["text"]
+            return grade
+        return None
+
+    def _regrade_row(self, row: Dict[str, Any], stop: threading.Event) -> Optional[Dict[str, Any]]:
+        grade = self._grade(row, stop)
+        if grade is None:
+            return None
+        grade["previous"] = _previous_text(row.get("grade_json"))
+        grade["regraded_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        grade["regrade_run"] = self.checkpoint.state["run_id"]
+        return {"id": row["id"], "student_name": row["student_name"], "grade_json": grade}
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        result = self.storage.bulk_update_grades(rows)
+        state = self.checkpoint.state
+        with self._lock:
+            # Rows that didn't save stay pending: their page isn't finished, so a resume regrades them
+            for row_id, error in result["failed"].items():
+                state["failed"][str(row_id)] = f"write failed: {error}"
+            saved = [r for r in rows if r["id"] not in result["failed"]]
+            for row in saved:
+                state["failed"].pop(str(row["id"]), None)
+            state["done_ids"] += [r["id"] for r in saved]
+            totals = state["totals"]
+            totals["processed"] += len(saved)
+            for row in saved:
+                outcome = _outcome(row["grade_json"])
+                totals[outcome] = totals.get(outcome, 0) + 1
+            if result["failed"] and not self.aborted:
+                self.aborted = f"stopped after {len(result['failed'])} regraded row(s) could not be saved"
+            self.checkpoint.save()
+        rows.clear()
+
+    def _index_results(self, stop: threading.Event) -> None:
+        """Complete grades already computed under the current fingerprint, by input key."""
+        cursor = None
+        while not stop.is_set():
+            page = self.storage.get_submissions_page("id, grade_json", page_size=INDEX_PAGE_SIZE, cursor=cursor)
+            for row in page["rows"]:
+                grade = row.get("grade_json")
+                if not is_stale(grade) and isinstance(grade, dict) and grade.get("input_key") and grade.get("text"):
+                    self._results[grade["input_key"]] = grade["text"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return
+
+    def _skip_current(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Mark rows an incremental run leaves alone as done; returns the rest."""
+        keep = [r for r in rows if is_stale(r.get("grade_json"))]
+        skipped = [r["id"] for r in rows if not is_stale(r.get("grade_json"))]
+        if skipped:
+            self.stats.skip(len(skipped))
+            state = self.checkpoint.state
+            with self._lock:
+                state["done_ids"] += skipped
+                state["totals"]["skipped"] = state["totals"].get("skipped", 0) + len(skipped)
+        return keep
+
+    def _mark_failed(self, row: Dict[str, Any], error: Exception, stop: threading.Event) -> None:
+        self.stats.record("failed")
+        state = self.checkpoint.state
+        with self._lock:
+            state["failed"][str(row["id"])] = str(error) or type(error).__name__
+            state["done_ids"].append(row["id"])
+            state["totals"]["processed"] += 1
+            state["totals"]["failed"] += 1
+            self._failure_streak.append(row["id"])
+            if len(self._failure_streak) >= MAX_CONSECUTIVE_FAILURES and not self.aborted:
+                self.aborted = f"stopped after {len(self._failure_streak)} failures in a row: {error}"
+                stop.set()
+            self.checkpoint.save()
+
+    def _forget_failure_streak(self) -> None:
+        """After an abort, make the rows that failed in a row pending again so a resume retries them."""
+        state = self.checkpoint.state
+        streak = set(self._failure_streak)
+        retry = [i for i in state["done_ids"] if i in streak]
+        state["done_ids"] = [i for i in state["done_ids"] if i not in streak]
+        for row_id in retry:
+            state["failed"].pop(str(row_id), None)
+        state["totals"]["processed"] -= len(retry)
+        state["totals"]["failed"] -= len(retry)
+
+    def run(self, stop: Optional[threading.Event] = None, limit: Optional[int] = None,
+            on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Regrade until done, stop is set, or limit rows were handled; returns the report."""
+        stop = stop or threading.Event()
+        checkpoint = self.checkpoint
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="regrade")
+        pending: List[Dict[str, Any]] = []   # regraded rows waiting for a batch write
+        try:
+            if self.stale_only:
+                self._index_results(stop)
+            while not checkpoint.state["finished"] and not stop.is_set():
+                page = self.storage.get_submissions_page(REGRADE_COLUMNS, page_size=self.page_size,
+                                                         cursor=checkpoint.cursor)
+                done = set(checkpoint.state["done_ids"])
+                rows = [r for r in page["rows"] if r["id"] not in done]
+                if self.stale_only:
+                    rows = self._skip_current(rows)
+                if limit is not None:
+                    rows = rows[:max(0, limit - self.stats.processed)]
+                futures = {pool.submit(self._regrade_row, row, stop): row for row in rows}
+                for future in as_completed(futures):
+                    try:
+                        regraded = future.result()
+                    except Exception as e:
+                        self._mark_failed(futures[future], e, stop)
+                        regraded = None
+                    if regraded is not None:
+                        self._failure_streak.clear()
+                        pending.append(regraded)
+                    if len(pending) >= WRITE_BATCH_SIZE:
+                        self._write(pending)
+                    if on_progress:
+                        on_progress(self.report())
+                self._write(pending)
+                if stop.is_set() or len(set(checkpoint.state["done_ids"])) < len(page["rows"]):
+                    break   # stopped, or limit reached mid-page: resume this page next time
+                checkpoint.page_done(page["next_cursor"])
+                checkpoint.save()
+                if limit is not None and self.stats.processed >= limit:
+                    break
+        finally:
+            stop.set()   # rows still queued return without grading
+            pool.shutdown(wait=True)
+            try:
+                self._write(pending)   # graded but unsaved when the loop raised
+            except Exception as e:
+                # Not marked done, so a resume regrades them
+                self.aborted = self.aborted or f"stopped: buffered grades could not be saved ({e})"
+            if self.aborted:
+                self._forget_failure_streak()
+            checkpoint.save()
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        state = self.checkpoint.state
+        return {**self.stats.report(), "run_id": state["run_id"], "prompt_version": state["prompt_version"],
+                "stale_only": state.get("stale_only", True), "finished": state["finished"],
+                "aborted": self.aborted, "totals": dict(state["totals"]), "failed_ids": list(state["failed"])}
+
+
+# ---------------------------
+# Background runner for the admin page
+# ---------------------------
+
+class RegradeRunner:
+    """At most one BulkRegrade per process, run on a thread the admin page polls."""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.engine: Optional[BulkRegrade] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, engine: BulkRegrade, limit: Optional[int] = None) -> None:
+        if self.running:
+            raise RuntimeError("A regrade is already running.")
+        self.engine, self.error, self.last_report = engine, None, None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(engine, limit), name="bulk-regrade", daemon=True)
+        try:
+            # Lets storage writes use the signed-in admin's client from session_state
+            from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+            add_script_run_ctx(self._thread, get_script_run_ctx())
+        except Exception:
+            pass
+        self._thread.start()
+
+    def _run(self, engine: BulkRegrade, limit: Optional[int]) -> None:
+        try:
+            self.last_report = engine.run(self._stop, limit)
+        except Exception as e:
+            self.error = str(e)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def report(self) -> Optional[Dict[str, Any]]:
+        if self.running and self.engine is not None:
+            return self.engine.report()
+        return self.last_report
+
+
+@st.cache_resource(show_spinner=False)
+def get_regrade_runner() -> RegradeRunner:
+    return RegradeRunner()
+
+
+# ---------------------------
+# Command line
+# ---------------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Regrade stored submissions with the current rubric and prompt.")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"),
+                        help="Gemini API key (default: $GEMINI_API_KEY, else GEMINI_API_KEY in secrets)")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE_PER_MIN, help="model requests per minute")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH)
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many submissions")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the newest row")
+    parser.add_argument("--all", action="store_true",
+                        help="regrade every row, not just stale ones (instructor edits included)")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        try:
+            args.api_key = st.secrets.get("GEMINI_API_KEY")
+        except Exception:
+            pass
+    if not args.api_key:
+        parser.error("no Gemini API key: pass --api-key or set GEMINI_API_KEY")
+
+    engine = BulkRegrade(get_storage(), get_gemini_clients(args.api_key), checkpoint_path=args.checkpoint,
+                         rate_per_min=args.rate, workers=args.workers, restart=args.restart,
+                         stale_only=not args.all)
+    stop = threading.Event()
+    last_print = [0.0]
+
+    def progress(report: Dict[str, Any]) -> None:
+        if time.monotonic() - last_print[0] >= 5:
+            last_print[0] = time.monotonic()
+            print(f"{report['processed']} done ({report['graded']} graded, {report['local']} local, "
+                  f"{report['reused']} reused, {report['failed']} failed, {report['skipped']} up to date) · {report['per_min']}/min · p50 {report['latency_p50_ms']} ms",
+                  file=sys.stderr)
+
+    try:
+        report = engine.run(stop, args.limit, progress)
+    except KeyboardInterrupt:
+        stop.set()
+        report = engine.report()
+        print("Interrupted; run again to resume from the checkpoint.", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] or report["aborted"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import datetime
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import streamlit as st
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from google.generativeai.client import FileServiceClient
+from google.generativeai.types import file_types
+
+# ---------------------------
+# Per-key Gemini clients
+# ---------------------------
+# genai.configure() sets one API key for the whole process, so concurrent students
+# would overwrite each other's key. Each key instead gets its own service clients
+# (one long-lived gRPC channel each) and cached model handles. Clients live in a
+# process-wide registry keyed by a hash of the key, evicted LRU and when idle.
+
+DEFAULT_MODEL = 'models/gemini-1.5-flash-latest'
+MAX_CLIENTS = 64
+CLIENT_IDLE_SEC = 30 * 60
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+class GeminiClients:
+    """Generative and file clients bound to one API key, plus cached GenerativeModel handles."""
+
+    def __init__(self, api_key: str):
+        options = {"api_key": api_key}
+        self.fingerprint = key_fingerprint(api_key)
+        self.generative = glm.GenerativeServiceClient(client_options=options)
+        self.files = FileServiceClient(client_options=options)
+        self._options = options
+        self._caches: Optional[glm.CacheServiceClient] = None
+        self._models: Dict[Tuple[str, str], genai.GenerativeModel] = {}
+        self._lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def model(self, model_name: str = DEFAULT_MODEL, **kwargs: Any) -> genai.GenerativeModel:
+        """A GenerativeModel that sends requests with this key (kwargs as for GenerativeModel)."""
+        cache_key = (model_name, repr(sorted(kwargs.items())))
+        with self._lock:
+            model = self._models.get(cache_key)
+            if model is None:
+                model = genai.GenerativeModel(model_name, **kwargs)
+                model._client = self.generative   # the SDK otherwise uses the process-global client
+                self._models[cache_key] = model
+        return model
+
+    @property
+    def caches(self) -> glm.CacheServiceClient:
+        """Context-cache client, created on first use (most keys never need one)."""
+        with self._lock:
+            if self._caches is None:
+                self._caches = glm.CacheServiceClient(client_options=self._options)
+        return self._caches
+
+    def create_cached_content(self, model_name: str, text: str, ttl_sec: float) -> str:
+        """Store text as a reusable context prefix for model_name; returns the cached content's name."""
+        cached = self.caches.create_cached_content(cached_content=glm.CachedContent(
+            model=model_name,
+            contents=[glm.Content(role="user", parts=[glm.Part(text=text)])],
+            ttl=datetime.timedelta(seconds=ttl_sec),
+        ))
+        return cached.name
+
+    def cached_model(self, cached_content_name: str, model_name: str = DEFAULT_MODEL) -> genai.GenerativeModel:
+        """A GenerativeModel whose requests are prefixed with an existing cached content.
+
+        Not kept in the model cache: cached contents expire and are replaced.
+        """
+        model = genai.GenerativeModel(model_name)
+        model._cached_content = cached_content_name   # what GenerativeModel.from_cached_content sets
+        model._client = self.generative
+        return model
+
+    def upload_file(self, data: bytes, mime_type: str) -> file_types.File:
+        response = self.files.create_file(path=io.BytesIO(data), mime_type=mime_type,
+                                          name=None, display_name=None, resumable=True)
+        return file_types.File(response)
+
+    def get_file(self, name: str) -> file_types.File:
+        return file_types.File(self.files.get_file(name=name))
+
+
+class GeminiClientRegistry:
+    """Bounded LRU of GeminiClients keyed by API-key fingerprint."""
+
+    def __init__(self, max_clients: int = MAX_CLIENTS, idle_sec: float = CLIENT_IDLE_SEC):
+        self.max_clients = max_clients
+        self.idle_sec = idle_sec
+        self._clients: "OrderedDict[str, GeminiClients]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key: str) -> GeminiClients:
+        fingerprint = key_fingerprint(api_key)
+        now = time.monotonic()
+        with self._lock:
+            clients = self._clients.get(fingerprint)
+            if clients is None:
+                clients = GeminiClients(api_key)
+                self._clients[fingerprint] = clients
+            self._clients.move_to_end(fingerprint)
+            clients.last_used = now
+            # Evicted clients are only dropped, not closed: another thread may still be using one
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            for stale in [k for k, c in self._clients.items() if now - c.last_used > self.idle_sec]:
+                del self._clients[stale]
+        return clients
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+@st.cache_resource(show_spinner=False)
+def get_client_registry() -> GeminiClientRegistry:
+    return GeminiClientRegistry()
+
+def get_gemini_clients(api_key: Optional[str]) -> GeminiClients:
+    """Clients for the student's own key. Raises ValueError if no key was given."""
+    if not api_key:
+        raise ValueError("No Gemini API key set. Go back to the login page and enter your key.")
+    return get_client_registry().get(api_key)
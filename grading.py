@@ -0,0 +1,474 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import streamlit as st
+
+from prompt_budget import Section, fit_sections
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------
+# Grading prompt and rubric
+# ---------------------------
+# Shared by the student page (live grading) and anything that regrades later.
+
+GRADING_MODEL = 'models/gemini-1.5-flash-latest'
+
+COURSE_NAME = "Generative AI Skill-Building"
+COURSE_GOALS = "to learn how to use and evaluate AI models"
+KEY_CONCEPTS = "Prompt Engineering, Prompt Workflow, Evaluation Metrics"
+
+ASSESSMENT_SUMMARY = '''
+Create a Prompt Engineering Workflow to generate personalized Human Bingo squares that facilitate meaningful connections between participants based on their survey responses.
+
+Requirements:
+- Generate 6 general squares (3 popular themes, 3 niche themes)
+- Create up to 3 personalized squares per participant
+- Use LLM prompts to extract themes and match participants
+- Include evaluation metrics for assessing output quality
+'''
+
+ASSESSMENT_REFLECTION_INSTRUCTIONS = '''The student reflections should cover the following:
+• a brief outline of initial thoughts about how they might break down the task,
+• discussion of how they created and initial prompt how they plan to iterate on it next based on results,
+• initial thoughts on evaluation metrics they will use to evaluate results of their prompts.'''
+
+PURPOSE = f'''You are a Teaching Assistant and you will be evaluating student submissions based on a given rubric. Students are taking part in a {COURSE_NAME} course to {COURSE_GOALS}. This includes learning the key concepts of {KEY_CONCEPTS}. If a student's submission does not include anything to grade (empty submission) then provide 0s for all the concepts and say "missing submission" for the reasoning since every student still requires a grade.'''
+
+ASSESSMENT_DETAILS = f'''Students were given an assessment where they had to solve a complex problem to test their understanding of {KEY_CONCEPTS}.
+Students were required to submit both their initial thoughts/reflections on how they plan to tackle the problem AND their final prompt/solution.
+{ASSESSMENT_REFLECTION_INSTRUCTIONS}'''
+
+MODEL_INSTRUCTIONS = '''Your task is to evaluate both the student's initial thoughts/reflections AND their final prompt/solution to assess their understanding of key concepts given in the rubric below. Consider both components when grading: '''
+
+RUBRIC_JSON = {
+    "Prompt Engineering": {"Description": "utilizes clear instructions, examples, formatting requirements and other best practices to design effective prompts.",
+        "Grades": {
+            "Missing (0%)": "No prompts are designed.",
+            "Major Misconceptions (50%)": "Prompts poorly designed with short or unclear instructions; no formatting requirements; few examples; no step-by-step guidance.",
+            "Nearly Proficient (80%)": "Prompts designed with some clarity, but instructions, formatting requirements, or examples may be irrelevant or lack important details.",
+            "Proficient (100%)": "Prompts well-designed with clear instructions, relevant examples, and logical step-by-step thinking.",
+            "Mastery (102%)": "Prompts exceptionally well-designed with clear instructions, highly relevant examples, and comprehensive step-by-step guidance."
+        }
+    },
+    "Prompt Workflow Breakdown": {"Description": "demonstrates clear step-by-step thinking to effectively break down into a series of prompts.",
+        "Grades": {
+            "Missing (0%)": "Problem not broken down into steps/prompts.",
+            "Major Misconceptions (50%)": "Breakdown poorly designed with very few or irrelevant steps.",
+            "Nearly Proficient (80%)": "Workflow has some steps/clarity, but may lack important details.",
+            "Proficient (100%)": "Workflow well-designed with clear instructions and logical step-by-step thinking.",
+            "Mastery (102%)": "Workflow exceptionally well-designed with comprehensive step-by-step breakdown."
+        }
+    },
+    "Evaluation Metrics": {"Description": "defines metrics that are well-defined and relevant to the problem",
+        "Grades": {
+            "Missing (0%)": "No metrics defined.",
+            "Major Misconceptions (50%)": "Not enough metrics or not applicable to context.",
+            "Nearly Proficient (80%)": "Metrics defined but may lack clarity or relevance.",
+            "Proficient (100%)": "Metrics are well designed; applicable and insightful.",
+            "Mastery (102%)": "Metrics fully defined with perfect clarity; applicable and insightful."
+        }
+    }
+}
+
+RUBRIC_INSTRUCTIONS = f'''For each of the three key concepts in the rubric: {KEY_CONCEPTS}, assign the student one of the Grades between Missing, Major Misconceptions, Nearly Proficient, Proficient, Mastery based on their understanding. Ensure the grades directly reflect the strengths and weaknesses identified in the critiques.'''
+
+EXPECTED_OUTPUT_FORMAT = '''
+Assessment Scores:
+
+Concept: [Concept Name]
+Grade: [Grade]
+Reasoning: [Rationale for score]
+
+Concept: [Concept Name]
+Grade: [Grade]
+Reasoning: [Rationale for score]
+
+Concept: [Concept Name]
+Grade: [Grade]
+Reasoning: [Rationale for score]
+'''
+
+EXPECTED_OUTPUT_EXAMPLES = '(Examples omitted for brevity)'
+
+
+def _static_prefix(rubric: Dict[str, Any], rubric_instructions: str, output_format: str) -> str:
+    """Everything before the student's submission; identical for every student."""
+    return f'''
+Purpose: {PURPOSE}
+
+Assessment Context: {ASSESSMENT_DETAILS}
+
+{MODEL_INSTRUCTIONS}
+
+Rubric: {rubric}
+
+{rubric_instructions}
+
+Output Format
+Use the following output format to output your results:
+{output_format}
+
+Students Assessment Problem Statement:
+Here is the problem statement that was given to the students:
+{ASSESSMENT_SUMMARY}
+
+Here are 3 examples of student submissions and their assessments:
+{EXPECTED_OUTPUT_EXAMPLES}
+
+'''
+
+def build_student_suffix(student_thoughts: str, student_final_prompt: str) -> str:
+    """The per-student part that follows a static prefix."""
+    return f'''Student Submission:
+
+STUDENT'S INITIAL THOUGHTS/REFLECTIONS:
+{student_thoughts}
+
+STUDENT'S FINAL PROMPT/SOLUTION:
+{student_final_prompt}
+'''
+
+def _concept_instructions(concept: str) -> str:
+    return f'''For the key concept {concept}, assign the student one of the Grades between Missing, Major Misconceptions, Nearly Proficient, Proficient, Mastery based on their understanding. Ensure the grade directly reflects the strengths and weaknesses identified in the critiques.'''
+
+def _concept_output_format(concept: str) -> str:
+    return f'''
+Concept: {concept}
+Grade: [Grade]
+Reasoning: [Rationale for score]
+'''
+
+def _prefix_version(prefix: str) -> str:
+    return hashlib.sha256(f"{GRADING_MODEL}\0{prefix}".encode()).hexdigest()[:12]
+
+# Built once at import: the static prefixes only change when this file does
+MASTER_PREFIX = _static_prefix(RUBRIC_JSON, RUBRIC_INSTRUCTIONS, EXPECTED_OUTPUT_FORMAT)
+CONCEPT_PREFIXES = {
+    concept: _static_prefix({concept: RUBRIC_JSON[concept]}, _concept_instructions(concept),
+                            _concept_output_format(concept))
+    for concept in RUBRIC_JSON
+}
+def build_master_prompt(student_thoughts: str, student_final_prompt: str) -> str:
+    """The single prompt that grades all rubric concepts at once."""
+    return MASTER_PREFIX + build_student_suffix(student_thoughts, student_final_prompt)
+
+def build_concept_prompt(concept: str, student_thoughts: str, student_final_prompt: str) -> str:
+    """The same prompt scoped to one rubric concept, answered with one Concept/Grade/Reasoning block."""
+    return CONCEPT_PREFIXES[concept] + build_student_suffix(student_thoughts, student_final_prompt)
+
+# Whole grading request (prefix included), so a long reflection can't make grading
+# arbitrarily slow; about 10x what a typical submission needs
+GRADING_PROMPT_TOKEN_BUDGET = 12000
+
+# ---------------------------
+# Grading fingerprint
+# ---------------------------
+# What produced a grade: the rubric, the prompt template (everything but the rubric
+# and the student's text, budget included) and the model. Stored with every grade,
+# so regrades can find the rows a change made stale. PREFIX_VERSION combines the three.
+
+def _short_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+PROMPT_TEMPLATE = "\0".join(
+    [_static_prefix("{rubric}", RUBRIC_INSTRUCTIONS, EXPECTED_OUTPUT_FORMAT),
+     _static_prefix("{rubric}", _concept_instructions("{concept}"), _concept_output_format("{concept}")),
+     build_student_suffix("{student_thoughts}", "{student_final_prompt}"),
+     f"token budget {GRADING_PROMPT_TOKEN_BUDGET}"])
+
+GRADING_FINGERPRINT = {
+    "rubric": _short_hash(json.dumps(RUBRIC_JSON, sort_keys=True)),
+    "prompt": _short_hash(PROMPT_TEMPLATE),
+    "model": GRADING_MODEL,
+}
+PREFIX_VERSION = _short_hash(json.dumps(GRADING_FINGERPRINT, sort_keys=True))
+
+def grade_fingerprint(grade: Any) -> Optional[str]:
+    """The combined fingerprint a stored grade_json was produced with (None if unknown)."""
+    if isinstance(grade, dict):
+        return (grade.get("fingerprint") or {}).get("id")
+    return None
+
+def fit_submission(student_thoughts: str, student_final_prompt: str,
+                   budget: int = GRADING_PROMPT_TOKEN_BUDGET) -> Tuple[str, str, Dict[str, Any]]:
+    """(thoughts, final_prompt, token_report) with both shrunk so the master prompt fits budget.
+
+    The reflection is reduced to its most representative sentences; the final prompt
+    keeps its beginning and end. Per-concept prompts have shorter prefixes, so they fit too.
+    """
+    texts, report = fit_sections([
+        Section("instructions", MASTER_PREFIX),
+        Section("submission_template", build_student_suffix("", "")),
+        Section("reflection", student_thoughts, shrink="extract"),
+        Section("final_prompt", student_final_prompt, shrink="head_tail"),
+    ], budget)
+    return texts["reflection"], texts["final_prompt"], report
+
+# ---------------------------
+# Provider context caching of the static prefix
+# ---------------------------
+# With GRADING_CONTEXT_CACHE on, each static prefix is stored once per API key as a
+# Gemini cached content, and per-student requests send only the student suffix.
+# It pays off when one key grades many submissions (a shared server key, bulk
+# regrades); with one key per student every cache would be used once. When the
+# provider refuses (model without caching support, prefix under its minimum
+# size) the refusal is remembered for PREFIX_CACHE_RETRY_SEC and requests carry
+# the full prompt. Either way the prefix comes first, so providers that cache
+# common prefixes implicitly can still reuse it.
+
+PREFIX_CACHE_TTL_SEC = 60 * 60
+PREFIX_CACHE_REFRESH_SEC = 5 * 60    # replace a cache this long before it expires rather than race it
+PREFIX_CACHE_RETRY_SEC = 60 * 60
+
+
+class PrefixCache:
+    """Cached-content names per (key fingerprint, prefix version), with expiry."""
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def model(self, clients, prefix: str):
+        """A model with prefix already in its context, or None if the provider can't cache it."""
+        key = (clients.fingerprint, _prefix_version(prefix))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            try:
+                name = clients.create_cached_content(GRADING_MODEL, prefix, PREFIX_CACHE_TTL_SEC)
+                entry = (now + PREFIX_CACHE_TTL_SEC - PREFIX_CACHE_REFRESH_SEC, name)
+            except Exception as e:
+                logger.info("context cache unavailable for prefix %s: %s", key[1], e)
+                entry = (now + PREFIX_CACHE_RETRY_SEC, None)
+            with self._lock:
+                for stale in [k for k, v in self._entries.items() if v[0] <= now]:
+                    del self._entries[stale]
+                self._entries[key] = entry
+        return clients.cached_model(entry[1], GRADING_MODEL) if entry[1] else None
+
+
+@st.cache_resource(show_spinner=False)
+def get_prefix_cache() -> PrefixCache:
+    return PrefixCache()
+
+def context_cache_enabled() -> bool:
+    try:
+        return str(st.secrets.get("GRADING_CONTEXT_CACHE", "false")).lower() in ("1", "true", "yes", "on")
+    except Exception:   # no secrets file, e.g. a command-line regrade run elsewhere
+        return False
+
+def grading_request(clients, prefix: str, student_thoughts: str, student_final_prompt: str) -> Tuple[Any, str, bool]:
+    """(model, prompt, prefix_cached): the suffix alone on a cached model, else the full prompt."""
+    suffix = build_student_suffix(student_thoughts, student_final_prompt)
+    if context_cache_enabled():
+        model = get_prefix_cache().model(clients, prefix)
+        if model is not None:
+            return model, suffix, True
+    return clients.model(GRADING_MODEL), prefix + suffix, False
+
+GRADING_TIMEOUT_SEC = 120
+
+def grade_once(clients, student_thoughts: str, student_final_prompt: str,
+               timeout_sec: float = GRADING_TIMEOUT_SEC) -> Dict[str, Any]:
+    """Grade with one non-streaming master-prompt request; returns the grade_json fields.
+
+    For callers without a page to stream into, such as bulk regrades.
+    """
+    thoughts, final_prompt, prompt_tokens = fit_submission(student_thoughts, student_final_prompt)
+    model, prompt, prefix_cached = grading_request(clients, MASTER_PREFIX, thoughts, final_prompt)
+    started = time.perf_counter()
+    text = model.generate_content(prompt, request_options={"timeout": timeout_sec}).text
+    return {
+        "text": text,
+        "timing": {"total_ms": round((time.perf_counter() - started) * 1000)},
+        **grade_provenance(student_thoughts, student_final_prompt),
+        "prompt_tokens": prompt_tokens,
+        "prefix_cached": prefix_cached,
+    }
+
+# ---------------------------
+# Concurrent per-concept grading
+# ---------------------------
+# One request per rubric concept, run in parallel and merged back into the
+# "Assessment Scores" format, so latency follows the slowest concept rather than
+# one long generation. Concepts still missing at CONCEPT_TIMEOUT_SEC (or whose
+# request failed) get a placeholder block and are listed in "ungraded" so an
+# instructor or a later regrade can fill them in. The timeout runs from when a
+# concept's request starts, so time spent queued for a worker during a burst
+# doesn't count against it. GRADING_WORKERS in secrets sizes the shared pool.
+
+CONCEPT_TIMEOUT_SEC = 60
+DEFAULT_GRADING_WORKERS = 12
+QUEUE_POLL_SEC = 0.5   # how often queued concepts are checked for having started
+
+def grading_workers() -> int:
+    try:
+        return max(1, int(st.secrets.get("GRADING_WORKERS", DEFAULT_GRADING_WORKERS)))
+    except Exception:   # no secrets file, e.g. a command-line regrade run elsewhere
+        return DEFAULT_GRADING_WORKERS
+
+@st.cache_resource(show_spinner=False)
+def _get_grading_pool(max_workers: int) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="grade")
+
+def _concept_block(concept: str, text: str) -> str:
+    lines = [l for l in (text or "").strip().splitlines() if l.strip() != "Assessment Scores:"]
+    block = "\n".join(lines).strip()
+    if not block.startswith("Concept:"):
+        block = f"Concept: {concept}\n{block}"
+    return block
+
+def _ungraded_block(concept: str, reason: str) -> str:
+    return f"Concept: {concept}\nGrade: Not graded\nReasoning: {reason}; an instructor will review this concept."
+
+def merge_concept_results(blocks: Dict[str, str]) -> str:
+    """Blocks in rubric order under the usual "Assessment Scores:" heading."""
+    ordered = [blocks[c] for c in RUBRIC_JSON if c in blocks]
+    return "Assessment Scores:\n\n" + "\n\n".join(ordered)
+
+def _grade_concept(clients, concept: str, student_thoughts: str, student_final_prompt: str,
+                   timeout_sec: float) -> str:
+    model, prompt, _ = grading_request(clients, CONCEPT_PREFIXES[concept], student_thoughts, student_final_prompt)
+    return model.generate_content(prompt, request_options={"timeout": timeout_sec}).text
+
+def grade_per_concept(clients, student_thoughts: str, student_final_prompt: str,
+                      timeout_sec: float = CONCEPT_TIMEOUT_SEC,
+                      on_progress: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Grade every concept concurrently with the key's clients; returns {"text", "timing", "ungraded"}.
+
+    on_progress(merged_text) is called from this thread each time a concept finishes.
+    """
+    started = time.perf_counter()
+    pool = _get_grading_pool(grading_workers())
+    running_since: Dict[str, float] = {}
+
+    def run(concept: str) -> str:
+        running_since[concept] = time.monotonic()
+        return _grade_concept(clients, concept, student_thoughts, student_final_prompt, timeout_sec)
+
+    futures = {pool.submit(run, c): c for c in RUBRIC_JSON}
+    pending = set(futures)
+    blocks: Dict[str, str] = {}
+    ungraded = []
+    timing: Dict[str, int] = {}
+    while pending:
+        deadlines = [running_since[futures[f]] + timeout_sec for f in pending if futures[f] in running_since]
+        wait_sec = min([QUEUE_POLL_SEC] + [d - time.monotonic() for d in deadlines])
+        done, pending = wait(pending, timeout=max(0.0, wait_sec), return_when=FIRST_COMPLETED)
+        for future in done:
+            concept = futures[future]
+            try:
+                blocks[concept] = _concept_block(concept, future.result())
+            except Exception as e:
+                blocks[concept] = _ungraded_block(concept, f"grading failed ({e})")
+                ungraded.append(concept)
+            timing.setdefault("ttft_ms", round((time.perf_counter() - started) * 1000))
+            if on_progress:
+                on_progress(merge_concept_results(blocks))
+        now = time.monotonic()
+        for future in [f for f in pending if now >= running_since.get(futures[f], now + 1) + timeout_sec]:
+            # Abandoned; the request timeout ends the call itself
+            pending.discard(future)
+            concept = futures[future]
+            blocks[concept] = _ungraded_block(concept, f"grading timed out after {timeout_sec:.0f}s")
+            ungraded.append(concept)
+    timing["total_ms"] = round((time.perf_counter() - started) * 1000)
+    return {"text": merge_concept_results(blocks), "timing": timing, "ungraded": ungraded}
+
+# ---------------------------
+# Grading front layer: rules and memoized results
+# ---------------------------
+# Answered locally before any model call. Submissions with nothing to grade get the
+# canonical result the rubric instructions prescribe ("missing submission", 0 for
+# every concept), and a byte-identical resubmission gets the grade it already
+# received, keyed by PREFIX_VERSION so a rubric or prompt change starts afresh.
+# Counters show what share of grading requests never reached the model.
+
+MEMO_MAX_ENTRIES = 2048
+_GRADEABLE = re.compile(r"[^\W_]")   # a letter or digit; underscores alone are not content
+
+def is_empty_submission(student_thoughts: str, student_final_prompt: str) -> bool:
+    """True when neither the reflection nor the final prompt has a letter or digit in it."""
+    return not (_GRADEABLE.search(student_thoughts or "") or _GRADEABLE.search(student_final_prompt or ""))
+
+def missing_submission_result() -> str:
+    return merge_concept_results({
+        c: f"Concept: {c}\nGrade: Missing (0%)\nReasoning: missing submission" for c in RUBRIC_JSON
+    })
+
+def submission_key(student_thoughts: str, student_final_prompt: str, version: str = PREFIX_VERSION) -> str:
+    return hashlib.sha256("\0".join([version, student_thoughts, student_final_prompt]).encode()).hexdigest()
+
+def grade_provenance(student_thoughts: str, student_final_prompt: str) -> Dict[str, Any]:
+    """Fields stored with every grade: its fingerprint and the key of the inputs it graded."""
+    return {
+        "prompt_version": PREFIX_VERSION,
+        "fingerprint": {**GRADING_FINGERPRINT, "id": PREFIX_VERSION},
+        "input_key": submission_key(student_thoughts, student_final_prompt),
+    }
+
+
+class GradingFrontLayer:
+    """Rule engine plus a bounded LRU memo of finished grades, with hit counters."""
+
+    def __init__(self, max_entries: int = MEMO_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._memo: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rule_hits = 0
+        self.memo_hits = 0
+        self.misses = 0
+
+    def lookup(self, student_thoughts: str, student_final_prompt: str,
+               count: bool = True) -> Optional[Dict[str, Any]]:
+        """{"text", "source": "rule" | "memo"} if no model call is needed, else None.
+
+        count=False leaves the hit counters alone, for offline traffic such as bulk
+        regrades that should not show up in the live grading numbers.
+        """
+        if is_empty_submission(student_thoughts, student_final_prompt):
+            if count:
+                with self._lock:
+                    self.rule_hits += 1
+            return {"text": missing_submission_result(), "source": "rule"}
+        key = submission_key(student_thoughts, student_final_prompt)
+        with self._lock:
+            text = self._memo.get(key)
+            if text is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._memo.move_to_end(key)
+            if count:
+                self.memo_hits += 1
+        return {"text": text, "source": "memo"}
+
+    def remember(self, student_thoughts: str, student_final_prompt: str, text: str) -> None:
+        """Store a complete model grade (not one with ungraded concepts) for resubmissions."""
+        key = submission_key(student_thoughts, student_final_prompt)
+        with self._lock:
+            self._memo[key] = text
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.rule_hits + self.memo_hits + self.misses
+            return {"rule_hits": self.rule_hits, "memo_hits": self.memo_hits, "misses": self.misses,
+                    "entries": len(self._memo),
+                    "hit_rate": round((self.rule_hits + self.memo_hits) / total, 3) if total else 0.0}
+
+
+@st.cache_resource(show_spinner=False)
+def get_grading_front() -> GradingFrontLayer:
+    return GradingFrontLayer()
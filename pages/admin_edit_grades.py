@@ -1,7 +1,6 @@
 import streamlit as st
-from supabase_client import get_all_submissions
-from ui_shared import create_admin_sidebar, create_student_view_button, render_admin_logout
-from collections import defaultdict
+from storage import get_storage
+from ui_shared import create_admin_sidebar, create_student_view_button, render_admin_logout, load_submission_pages, loaded_submission_pages, render_load_more, reset_submission_pages, student_label
 
 # Sidebar and button
 create_admin_sidebar()
@@ -53,44 +52,102 @@ st.markdown('</div>', unsafe_allow_html=True)
 st.markdown("<h1 style='color:#F4AAB9;'>✏️ Edit Grades</h1>", unsafe_allow_html=True)
 st.markdown("Use this page to **view and edit all student grades directly** in one place.")
 
-# Fetch and display submissions
-submissions = get_all_submissions()
-st.success(f"📦 Total Submissions: {len(submissions)}")
+# ---------- Dirty-row tracking ----------
+# edited grades not yet saved: {submission_id: {"id", "student_name", "grade_json"}}
+if "dirty_grades" not in st.session_state:
+    st.session_state.dirty_grades = {}
+# outcome of the last bulk save: {submission_id: None (saved) or error message}
+if "grade_save_results" not in st.session_state:
+    st.session_state.grade_save_results = {}
 
-if not submissions:
+def _mark_dirty(sub, original):
+    value = st.session_state[f"grade_input_{sub['id']}"]
+    if value == original:
+        st.session_state.dirty_grades.pop(sub["id"], None)
+    else:
+        st.session_state.dirty_grades[sub["id"]] = {
+            "id": sub["id"],
+            "student_name": sub["student_name"],
+            "grade_json": value,
+        }
+
+def _apply_saved_rows(updated):
+    """Refresh only the saved rows inside the pages already loaded on this screen."""
+    for state in loaded_submission_pages():
+        for row in state["rows"]:
+            if row["id"] in updated:
+                row["grade_json"] = updated[row["id"]].get("grade_json")
+
+def _save_dirty_grades():
+    result = get_storage().bulk_update_grades(list(st.session_state.dirty_grades.values()))
+    _apply_saved_rows(result["updated"])
+    for sub_id in result["updated"]:
+        st.session_state.dirty_grades.pop(sub_id, None)
+        st.session_state.pop(f"grade_input_{sub_id}", None)  # re-seed the text area from the saved row
+    st.session_state.grade_save_results = {
+        **{sub_id: None for sub_id in result["updated"]},
+        **result["failed"],
+    }
+
+# Fetch and display submissions: summaries first, rows only for opened students
+if st.button("🔄 Refresh", key="edit_grades_refresh"):
+    reset_submission_pages()
+summaries = get_storage().get_student_summaries()
+st.success(f"📦 Total Submissions: {sum(s['submission_count'] for s in summaries)}")
+cache = get_storage().cache_stats()
+if cache:
+    st.caption(f"Shared cache: {cache['hits']} hits / {cache['misses']} misses")
+
+if not summaries:
     st.info("No submissions yet.")
     st.stop()
 
-grouped = defaultdict(list)
-for sub in submissions:
-    grouped[sub["student_name"]].append(sub)
+num_dirty = len(st.session_state.dirty_grades)
+save_col, status_col = st.columns([1, 3])
+with save_col:
+    st.button(f"💾 Save {num_dirty} changed grade{'s' if num_dirty != 1 else ''}",
+              key="save_dirty_grades", disabled=(num_dirty == 0), on_click=_save_dirty_grades)
+with status_col:
+    results = st.session_state.grade_save_results
+    if results:
+        num_failed = sum(1 for err in results.values() if err)
+        if num_failed:
+            st.error(f"Saved {len(results) - num_failed} grade(s); {num_failed} failed. See the rows marked ❌.")
+        else:
+            st.success(f"Saved {len(results)} grade(s).")
 
 #st.divider()
 
-for student_name, subs in grouped.items():
-    with st.expander(f"👤 {student_name} ({len(subs)} submission{'s' if len(subs) != 1 else ''})", expanded=False):
+for summary in summaries:
+    student_name = summary["student_name"]
+    expander = st.expander(student_label(summary), expanded=False,
+                           key=f"edit_grades_open_{student_name}", on_change="rerun")
+    with expander:
+        if not expander.open:
+            continue
+        subs = load_submission_pages(student_name, student_name=student_name)
         for i, sub in enumerate(subs):
             st.markdown(f"**Submission #{i + 1}**")
             st.markdown(f"🕒 Submitted: `{sub['created_at']}`")
             st.markdown(f"📜 Transcript:\n\n{sub['transcript_text']}")
 
             current_grade = sub.get("grade_json") or sub.get("grade_json") or ""
-            new_grade = st.text_area(
+            dirty = st.session_state.dirty_grades.get(sub["id"])
+            st.text_area(
                 f"✏️ Edit Grade (Current: {current_grade})",
-                value=current_grade,
-                key=f"grade_input_{sub['id']}"
+                value=dirty["grade_json"] if dirty else current_grade,
+                key=f"grade_input_{sub['id']}",
+                on_change=_mark_dirty,
+                args=(sub, current_grade),
             )
-
-            if st.button(f"💾 Save Grade for #{i + 1}", key=f"save_{sub['id']}"):
-                from supabase_client import get_client
-                sb = get_client()
-                try:
-                    sb.table("submissions").update({
-                        "grade_json": new_grade
-                    }).eq("id", sub["id"]).execute()
-                    st.success("Grade saved successfully.")
-                    st.rerun()  # This will refresh the page and reflect the updated grade
-                except Exception as e:
-                    st.error(f"Error saving grade: {e}")
+            if dirty:
+                st.caption("● Unsaved change")
+            if sub["id"] in st.session_state.grade_save_results:
+                error = st.session_state.grade_save_results[sub["id"]]
+                if error:
+                    st.markdown(f"❌ Not saved: {error}")
+                else:
+                    st.markdown("✅ Saved")
 
             #st.divider()
+        render_load_more(student_name)
@@ -1,6 +1,6 @@
 import streamlit as st
-from ui_shared import create_admin_sidebar, create_student_view_button, render_admin_logout
-from supabase_client import get_client
+from ui_shared import create_admin_sidebar, create_student_view_button, render_admin_logout, reset_submission_pages
+from storage import get_storage
 
 # Set page layout and background fix
 st.set_page_config(page_title="Edit Grade", layout="wide")
@@ -103,12 +103,10 @@ with col2:
         new_grade = st.text_area("Update Grade (JSON or Summary):", value=str(target['grade']), height=300)
         submit = st.form_submit_button("💾 Save Grade")
         if submit:
-            sb = get_client()
             try:
-                sb.table("submissions").update({
-                    "grade_json": new_grade
-                }).eq("id", target["id"]).execute()
+                get_storage().update_grade(target["id"], new_grade)
                 st.session_state.edit_target['grade'] = new_grade  # update local session state
+                reset_submission_pages()  # dashboards refetch their first page
                 st.success("Grade updated successfully.")
                 st.rerun()  # refresh page to reflect change
             except Exception as e:
@@ -1,7 +1,11 @@
 import streamlit as st
-from supabase_client import get_all_submissions
-from ui_shared import create_admin_sidebar, create_student_view_button, render_admin_logout
-from collections import defaultdict
+from submission_mirror import get_submission_mirror
+from submission_feed import get_submission_feed
+from submission_outbox import outbox_stats
+from grading import get_grading_front
+from ui_shared import create_admin_sidebar, create_student_view_button, render_admin_logout, student_label
+
+LIVE_CHECK_SEC = 3   # how often the page looks for pushed submission changes
 
 # Set wide layout and custom background
 st.set_page_config(page_title="Admin Dashboard", layout="wide")
@@ -69,25 +73,54 @@ As an instructor, you can:
 - Update student grades if needed
 """)
 
-# Fetch data
-submissions = get_all_submissions()
-num_submissions = len(submissions)
+# Fetch data: the shared local copy pulls only rows changed since its last sync
+mirror = get_submission_mirror()
+mirror.sync(force=st.button("🔄 Refresh", key="admin_home_refresh"))
+summaries = mirror.student_summaries()
+
+# Students whose rows changed since this session last rendered
+seen_version = st.session_state.get("admin_home_seen_version", mirror.version)
+changed_students = set(mirror.changed_since(seen_version))
+st.session_state.admin_home_seen_version = mirror.version
+
+@st.fragment(run_every=LIVE_CHECK_SEC)
+def _watch_for_changes():
+    # In-memory version check only; pushed changes trigger a rerun, no table reads
+    if mirror.version != st.session_state.admin_home_seen_version:
+        st.rerun()
 
-if not submissions:
+_watch_for_changes()
+
+if not summaries:
     st.info("No submissions found yet.")
     st.stop()
 
+num_submissions = sum(s["submission_count"] for s in summaries)
 st.success(f"📦 Total Submissions: {num_submissions}")
+pending = outbox_stats()
+if pending and (pending["pending"] or pending["dead"]):
+    st.warning(f"📮 {pending['pending']} submission(s) still syncing from the local outbox"
+               + (f", {pending['dead']} failed permanently" if pending["dead"] else ""))
+feed_status = "live updates on" if get_submission_feed().connected else "refresh to check for changes"
+st.caption(f"Local copy: {len(mirror)} rows • last sync pulled {mirror.last_delta} change(s) • {feed_status}")
+grading_stats = get_grading_front().stats()
+if grading_stats["rule_hits"] + grading_stats["memo_hits"] + grading_stats["misses"]:
+    st.caption(f"Grading since restart: {grading_stats['hit_rate']:.0%} answered without a model call "
+               f"({grading_stats['rule_hits']} empty, {grading_stats['memo_hits']} resubmitted, "
+               f"{grading_stats['misses']} graded)")
+if changed_students:
+    st.info("🆕 New or updated submissions: " + ", ".join(sorted(changed_students)))
 st.divider()
 
-# Group by student name
-grouped = defaultdict(list)
-for sub in submissions:
-    grouped[sub["student_name"]].append(sub)
-
 # Loop through students
-for student_name, subs in grouped.items():
-    with st.expander(f"👤 {student_name} ({len(subs)} submission{'s' if len(subs) != 1 else ''})", expanded=False):
+for summary in summaries:
+    student_name = summary["student_name"]
+    expander = st.expander(student_label(summary), expanded=False,
+                           key=f"admin_home_open_{student_name}", on_change="rerun")
+    with expander:
+        if not expander.open:
+            continue
+        subs = mirror.submissions_for(student_name)
         for i, sub in enumerate(subs):
             st.markdown(f"### Submission #{i + 1}")
             st.markdown(f"**Submitted at:** {sub['created_at']}")
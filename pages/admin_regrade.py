@@ -0,0 +1,139 @@
+import os
+import streamlit as st
+from bulk_regrade import (BulkRegrade, RegradeCheckpoint, get_regrade_runner, DEFAULT_CHECKPOINT_PATH,
+                          DEFAULT_RATE_PER_MIN, DEFAULT_WORKERS)
+from gemini_clients import get_gemini_clients
+from grading import GRADING_FINGERPRINT, PREFIX_VERSION
+from storage import get_storage
+from ui_shared import create_admin_sidebar, create_student_view_button, render_admin_logout
+
+PROGRESS_POLL_SEC = 2
+
+st.set_page_config(page_title="Regrade Submissions", layout="wide")
+
+# Shared sidebar
+create_admin_sidebar()
+render_admin_logout()
+
+# Same Blossom theme as the other admin pages
+st.markdown("""
+<style>
+html, body, [data-testid="stAppViewContainer"], [data-testid="stApp"] {
+    background-color: #2f2433 !important;
+    color: #f2f2f2 !important;
+    height: 100%;
+    width: 100%;
+    margin: 0;
+    padding: 0;
+}
+[data-testid="stHeader"] {
+    background: transparent !important;
+    height: 0 !important;
+    border-bottom: none !important;
+}
+.stButton > button {
+    background-color: #d46a8c;
+    color: white !important;
+    border-radius: 8px;
+    padding: 10px 20px;
+    font-weight: 600;
+    border: none;
+}
+.stButton > button:hover {
+    background-color: #b45873;
+}
+h1, h2, h3, h4, h5 {
+    color: #ffb6c1 !important;
+}
+</style>
+""", unsafe_allow_html=True)
+
+create_student_view_button()
+
+st.markdown("<h1 style='color:#F4AAB9;'>🔁 Regrade Submissions</h1>", unsafe_allow_html=True)
+st.markdown(f"Regrades stored submissions with the current rubric, prompt and model (fingerprint `{PREFIX_VERSION}`). "
+            "By default only stale grades are redone: ungraded rows, partial grades and grades from another fingerprint. "
+            "Instructor edits are left alone, and resubmissions reuse an existing result. "
+            "Each regraded row keeps the grade it replaced under `previous`.")
+st.caption(f"Rubric `{GRADING_FINGERPRINT['rubric']}` · prompt `{GRADING_FINGERPRINT['prompt']}` · "
+           f"model `{GRADING_FINGERPRINT['model']}`")
+
+runner = get_regrade_runner()
+
+# ---------- Saved progress ----------
+if os.path.exists(DEFAULT_CHECKPOINT_PATH) and not runner.running:
+    checkpoint = RegradeCheckpoint(DEFAULT_CHECKPOINT_PATH)
+    saved, totals = checkpoint.state, checkpoint.state["totals"]
+    if not checkpoint.has_progress:
+        pass   # nothing to resume; Start begins a fresh run either way
+    elif saved["finished"]:
+        st.caption(f"Last run finished: {totals['processed']} submissions ({totals['failed']} failed).")
+    elif saved["prompt_version"] != PREFIX_VERSION:
+        st.warning("An unfinished run used an older rubric or prompt; starting over is required.")
+    else:
+        st.info(f"An unfinished run stopped after {totals['processed']} submissions; Start resumes it.")
+
+# ---------- Run settings ----------
+try:
+    secrets_key = st.secrets.get("GEMINI_API_KEY", "")
+except Exception:
+    secrets_key = ""
+api_key = st.text_input("Gemini API key for regrading", type="password", key="regrade_api_key",
+                        placeholder="Using GEMINI_API_KEY from secrets" if secrets_key else "")
+api_key = api_key or secrets_key or st.session_state.get("api_key")
+col_rate, col_workers, col_limit = st.columns(3)
+with col_rate:
+    rate = st.number_input("Requests per minute", min_value=1, max_value=2000, value=DEFAULT_RATE_PER_MIN)
+with col_workers:
+    workers = st.number_input("Parallel requests", min_value=1, max_value=32, value=DEFAULT_WORKERS)
+with col_limit:
+    limit = st.number_input("Stop after (0 = all)", min_value=0, value=0)
+restart = st.checkbox("Start over (ignore saved progress)", key="regrade_restart")
+regrade_all = st.checkbox("Regrade every submission, including up-to-date grades and instructor edits",
+                          key="regrade_all")
+
+start_col, stop_col = st.columns([1, 1])
+with start_col:
+    if st.button("▶️ Start / Resume", key="regrade_start", disabled=runner.running):
+        try:
+            engine = BulkRegrade(get_storage(), get_gemini_clients(api_key), rate_per_min=rate,
+                                 workers=int(workers), restart=restart, stale_only=not regrade_all)
+            runner.start(engine, limit=int(limit) or None)
+            st.rerun()   # swap the enabled buttons
+        except Exception as e:
+            st.error(f"Could not start the regrade: {e}")
+with stop_col:
+    if st.button("⏹️ Stop", key="regrade_stop", disabled=not runner.running):
+        runner.stop()
+        st.info("Stopping after the requests in flight finish…")
+
+# ---------- Progress ----------
+@st.fragment(run_every=PROGRESS_POLL_SEC)
+def _show_progress():
+    # Rerun the whole page once a run ends so the Start/Stop buttons update
+    if runner.running:
+        st.session_state.regrade_was_running = True
+    elif st.session_state.pop("regrade_was_running", False):
+        st.rerun()
+    report = runner.report()
+    if runner.error:
+        st.error(f"Regrade failed: {runner.error}")
+    if not report:
+        return
+    if report.get("aborted"):
+        st.error(f"Regrade {report['aborted']}. Fix the cause and Start again to resume.")
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Submissions", report["processed"], help=f"{report['totals']['processed']} in this run overall")
+    c2.metric("Per minute", report["per_min"])
+    c3.metric("Latency p50 / p95",
+              f"{report['latency_p50_ms'] or 0} / {report['latency_p95_ms'] or 0} ms")
+    c4.metric("Failed", report["failed"], help=f"{report['retries']} retried request(s)")
+    st.caption(f"{report['graded']} graded by the model · {report['local']} answered locally · "
+               f"{report['reused']} reused · {report['skipped']} already up to date · "
+               f"{report['elapsed_sec']}s elapsed")
+    if report["finished"]:
+        st.success("✅ Every submission is graded with the current rubric and prompt.")
+    if report["failed_ids"]:
+        st.markdown("Failed submission ids: " + ", ".join(report["failed_ids"]))
+
+_show_progress()
@@ -1,5 +1,5 @@
 import streamlit as st
-from supabase_client import sign_up, sign_in
+from storage import get_storage
 
 # Redirect to dashboard if already logged in
 if "user_email" in st.session_state and st.session_state.user_email:
@@ -122,7 +122,7 @@ password = st.text_input("Password", type="password", value=st.session_state.get
 
 if st.session_state.is_signup:
     if st.button("Register"):
-        user = sign_up(email, password)
+        user = get_storage().sign_up(email, password)
         if user and user.user:
             st.session_state.temp_email = email
             st.session_state.temp_password = password
@@ -132,7 +132,7 @@ if st.session_state.is_signup:
 
 else:
     if st.button("Login"):
-        user = sign_in(email, password)
+        user = get_storage().sign_in(email, password)
         if user and user.user:
             st.session_state.user_email = user.user.email
             st.success(f"🎉 Welcome, {email}!")
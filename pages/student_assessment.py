@@ -1,16 +1,24 @@
 import streamlit as st
-import google.generativeai as genai
-import io
 import os
 from streamlit_mic_recorder import mic_recorder
 from google.api_core.exceptions import GoogleAPIError
 from datetime import datetime
 import json
-from supabase_client import insert_submission
+from submission_outbox import submit_submission
+from transcription import checkpoint_new_audio, append_transcript
+from transcription_jobs import get_transcription_jobs
+from gemini_clients import get_gemini_clients
+from grading import (MASTER_PREFIX, build_master_prompt, fit_submission, get_grading_front, grade_per_concept,
+                     grade_provenance, grading_request, is_empty_submission)
+from segmented_recorder import SegmentBuffer, segment_recorder
+from prompt_budget import Section, fit_sections
 import time
+import logging
 from html import escape  # add near imports
 import streamlit.components.v1 as components  # for JS timer
 
+logger = logging.getLogger(__name__)
+
 # Streamlit needs this BEFORE any UI calls
 st.set_page_config(page_title="Blossom Assessment - Assessment", layout="wide")
 
@@ -144,10 +152,24 @@ if 'show_editor' not in st.session_state:
     st.session_state.show_editor = False
 if 'grade_feedback' not in st.session_state:
     st.session_state.grade_feedback = None
+if 'grade_shown' not in st.session_state:
+    st.session_state.grade_shown = False
+if 'grade_timing' not in st.session_state:
+    st.session_state.grade_timing = None  # {"ttft_ms", "total_ms"} of the last grading stream
 if 'grading_prompt_text' not in st.session_state:
     st.session_state.grading_prompt_text = ""
 if 'assessment_started_at' not in st.session_state:
     st.session_state.assessment_started_at = time.time()
+if 'recorded_audio_id' not in st.session_state:
+    st.session_state.recorded_audio_id = None
+if 'transcription_progress' not in st.session_state:
+    st.session_state.transcription_progress = {"recording_id": None, "frame": 0}  # audio already transcribed
+# "segmented" streams audio to the server while recording; "classic" is mic_recorder (Stop first)
+USE_SEGMENTED_RECORDER = str(st.secrets.get("RECORDER_MODE", "segmented")).lower() == "segmented"
+if 'segment_buffer' not in st.session_state:
+    st.session_state.segment_buffer = SegmentBuffer()
+if 'transcription_job' not in st.session_state:
+    st.session_state.transcription_job = None  # {"id", "reason", "nudge"} while a background job is in flight
 
 # NEW: Auto-transcription tracking
 if 'auto_transcribed_1m' not in st.session_state:
@@ -180,85 +202,175 @@ def get_phase_and_remaining():
         return 'locked', -1
 
 # -------------------- NEW: Nudge generator --------------------
-def generate_timer_nudge(transcript_text: str, trigger_reason: str) -> str:
-    """Return a brief, actionable nudge (max 2 sentences)."""
-    try:
-        if not transcript_text.strip():
-            return "Capture your initial plan in 1–2 sentences before proceeding."
-        prompt = f"""
+def _nudge_instructions(trigger_reason: str) -> str:
+    return f"""
 You are a concise TA. Based on the student's current reflection, give ONE short, actionable nudge (max 2 sentences) to improve clarity, workflow, or evaluation planning.
 
 Trigger: {trigger_reason}
-Student reflection so far:
-\"\"\"{transcript_text.strip()[:4000]}\"\"\"
 """
-        model = genai.GenerativeModel('models/gemini-1.5-flash-latest')
+
+def _clean_nudge(text: str) -> str:
+    text = (text or "").strip()[:500]
+    return text or "Add one concrete next step (e.g., define success criteria or split your prompt into steps)."
+
+NUDGE_PROMPT_TOKEN_BUDGET = 1200   # text of a nudge request (roughly the 4000 characters it used to cut at)
+
+def _nudge_prompt(trigger_reason: str, label: str, reflection: str, shrink: str) -> str:
+    """Nudge instructions plus as much of the reflection as fits NUDGE_PROMPT_TOKEN_BUDGET."""
+    texts, report = fit_sections([
+        Section("instructions", _nudge_instructions(trigger_reason) + f'{label}\n"""'),
+        Section("reflection", reflection.strip(), shrink=shrink),
+        Section("closing", '"""\n'),
+    ], NUDGE_PROMPT_TOKEN_BUDGET)
+    logger.debug("nudge prompt tokens: %s", report)
+    return texts["instructions"] + texts["reflection"] + texts["closing"]
+
+def generate_timer_nudge(transcript_text: str, trigger_reason: str, api_key: str = None) -> str:
+    """Return a brief, actionable nudge (max 2 sentences)."""
+    try:
+        if not transcript_text.strip():
+            return "Capture your initial plan in 1–2 sentences before proceeding."
+        prompt = _nudge_prompt(trigger_reason, "Student reflection so far:", transcript_text, "head_tail")
+        model = get_gemini_clients(api_key).model('models/gemini-1.5-flash-latest')
         resp = model.generate_content(prompt)
-        text = (resp.text or "").strip()[:500]
-        return text or "Add one concrete next step (e.g., define success criteria or split your prompt into steps)."
+        return _clean_nudge(resp.text)
     except Exception:
         return "Write one concrete next step you’ll take next."
 
-def perform_auto_transcription(trigger_reason) -> bool:
-    """Perform automatic transcription and update session state. Returns True on success."""
-    # No audio yet (user hasn't clicked Stop)
-    if st.session_state.recorded_audio_bytes is None:
-        msg = "No recording found—click Stop to capture audio, then resume. (We can only snapshot finished recordings.)"
-        st.session_state.timer_nudges.append({
-            "when": trigger_reason,
-            "text": msg,
-            "ts": int(time.time())
-        })
-        st.warning(f"Auto-transcription triggered ({trigger_reason}) but no recording found.")
-        return False
-    
+# -------------------- Background transcription --------------------
+JOB_POLL_SEC = 1        # how often the page checks an in-flight job
+SUBMIT_WAIT_SEC = 60    # submitting waits this long for an in-flight job's text
+ROLLING_TRANSCRIBE_SEC = 120   # segmented mode: transcribe in the background once this much is pending
+
+def _current_recording_id():
+    if USE_SEGMENTED_RECORDER:
+        return st.session_state.segment_buffer.recording_id
+    return st.session_state.recorded_audio_id
+
+def _transcribed_frame() -> int:
+    progress = st.session_state.transcription_progress
+    return progress["frame"] if progress["recording_id"] == _current_recording_id() else 0
+
+def _has_audio() -> bool:
+    if USE_SEGMENTED_RECORDER:
+        return st.session_state.segment_buffer.pending_sec(_transcribed_frame()) > 0
+    return st.session_state.recorded_audio_bytes is not None
+
+def _audio_for_job():
+    """(wav_bytes, recording_id, progress, frame_offset) covering audio not yet transcribed."""
+    if USE_SEGMENTED_RECORDER:
+        buf = st.session_state.segment_buffer
+        start = max(_transcribed_frame(), buf.base)
+        # Only the untranscribed tail is copied; frames in it are relative to start
+        return buf.wav_since(start), buf.recording_id, {"recording_id": buf.recording_id, "frame": 0}, start
+    return (st.session_state.recorded_audio_bytes, st.session_state.recorded_audio_id,
+            st.session_state.transcription_progress, 0)
+
+def _run_transcription_job(audio_bytes, recording_id, progress, frame_offset, final, api_key,
+                           existing_text, trigger_reason, want_nudge):
+    """Runs on a pool thread: transcribe new audio (and optionally nudge). No session_state here."""
+    progress = dict(progress)
+    instructions = None
+    if want_nudge:
+        # One request returns the new transcript and the nudge together
+        instructions = _nudge_prompt(trigger_reason, "Earlier reflection (the audio continues it):",
+                                     existing_text, "tail")
+    text, nudge = checkpoint_new_audio(audio_bytes, recording_id, progress, final=final, api_key=api_key,
+                                       nudge_instructions=instructions)
+    progress["frame"] += frame_offset
+    if nudge is not None:
+        nudge = _clean_nudge(nudge)
+    elif want_nudge:
+        # No new audio, cached audio, or an unparseable reply: fall back to a separate nudge call
+        nudge = generate_timer_nudge(append_transcript(existing_text, text or ""), trigger_reason, api_key)
+    return {"text": text, "progress": progress, "nudge": nudge}
+
+def start_transcription_job(trigger_reason: str, final: bool, want_nudge: bool) -> None:
+    """Hand the current recording to the background runner and remember the job id."""
+    job_id = get_transcription_jobs().submit(
+        _run_transcription_job,
+        *_audio_for_job(),
+        final,
+        st.session_state.get("api_key"),
+        st.session_state.edited_transcription_text,
+        trigger_reason,
+        want_nudge,
+    )
+    st.session_state.transcription_job = {"id": job_id, "reason": trigger_reason, "nudge": want_nudge}
+
+def collect_transcription_job(wait_sec: float = 0) -> None:
+    """Apply a finished job's transcript, progress and nudge to the session (no-op while it runs)."""
+    job = st.session_state.transcription_job
+    if job is None:
+        return
+    jobs = get_transcription_jobs()
+    if not jobs.wait(job["id"], timeout=wait_sec):
+        return
+    st.session_state.transcription_job = None
+    trigger_reason = job["reason"]
     try:
-        mime_type = "audio/wav"
-        audio_io = io.BytesIO(st.session_state.recorded_audio_bytes)
-        audio_file = genai.upload_file(
-            path=audio_io,   # if your SDK requires a real path, write audio_io to a temp file and pass that path
-            mime_type=mime_type,
-        )
-        
-        # Poll until processed
-        while getattr(audio_file, "state", None) and getattr(audio_file.state, "name", "") == "PROCESSING":
-            time.sleep(1)
-            audio_file = genai.get_file(audio_file.name)
-
-        prompt = "Transcribe the given audio accurately. Provide only the spoken text."
-        model = genai.GenerativeModel('models/gemini-1.5-flash-latest')
-        response = model.generate_content([audio_file, prompt])
-        transcription_text = response.text or ""
-        st.session_state.edited_transcription_text = transcription_text
-
-        # Generate and store a nudge (even if transcript is short)
-        try:
-            nudge = generate_timer_nudge(st.session_state.edited_transcription_text, trigger_reason)
-        except Exception:
-            nudge = "Write one concrete next step you’ll take next."
+        result = jobs.pop_result(job["id"])
+    except GoogleAPIError as api_err:
+        if job["nudge"]:
+            st.session_state.timer_nudges.append({
+                "when": trigger_reason,
+                "text": f"Transcription failed: {api_err.message}",
+                "ts": int(time.time())
+            })
+        st.error(f"Transcription failed ({trigger_reason}): {api_err.message}")
+        return
+    except Exception as e:
+        if job["nudge"]:
+            st.session_state.timer_nudges.append({
+                "when": trigger_reason,
+                "text": f"Transcription error: {e}",
+                "ts": int(time.time())
+            })
+        st.error(f"Transcription error ({trigger_reason}): {e}")
+        return
+
+    # A new recording may have started while the job ran; its progress no longer applies
+    if result["progress"]["recording_id"] == _current_recording_id():
+        st.session_state.transcription_progress = result["progress"]
+        if USE_SEGMENTED_RECORDER:
+            st.session_state.segment_buffer.discard_before(result["progress"]["frame"])
+    if result["text"]:
+        st.session_state.edited_transcription_text = append_transcript(
+            st.session_state.edited_transcription_text, result["text"])
+    elif result["text"] is None and trigger_reason == "manual":
+        st.info("Everything recorded so far is already transcribed.")
+    if job["nudge"]:
         st.session_state.timer_nudges.append({
             "when": trigger_reason,
-            "text": nudge,
+            "text": result["nudge"] or "Write one concrete next step you’ll take next.",
             "ts": int(time.time())
         })
-
         st.success(f"Auto-transcription completed ({trigger_reason})")
-        return True
-        
-    except GoogleAPIError as api_err:
-        err_msg = f"Transcription failed: {api_err.message}"
+
+def perform_auto_transcription(trigger_reason) -> bool:
+    """Start a background checkpoint transcription. Returns True if a job was started."""
+    # No audio yet (user hasn't recorded, or in classic mode hasn't clicked Stop)
+    if not _has_audio():
+        if USE_SEGMENTED_RECORDER:
+            msg = "No new audio since the last checkpoint—click Start Recording and talk through your approach."
+        else:
+            msg = "No recording found—click Stop to capture audio, then resume. (We can only snapshot finished recordings.)"
         st.session_state.timer_nudges.append({
             "when": trigger_reason,
-            "text": err_msg,
+            "text": msg,
             "ts": int(time.time())
         })
-        st.error(f"Auto-transcription failed ({trigger_reason}): {api_err.message}")
+        st.warning(f"Auto-transcription triggered ({trigger_reason}) but no recording found.")
         return False
+
+    try:
+        # Only the audio recorded since the last checkpoint is sent
+        start_transcription_job(trigger_reason, final=(trigger_reason == "60 minutes"), want_nudge=True)
+        return True
     except Exception as e:
-        err_msg = f"Transcription error: {e}"
         st.session_state.timer_nudges.append({
             "when": trigger_reason,
-            "text": err_msg,
+            "text": f"Transcription error: {e}",
             "ts": int(time.time())
         })
         st.error(f"Auto-transcription error ({trigger_reason}): {e}")
@@ -266,6 +378,9 @@ def perform_auto_transcription(trigger_reason) -> bool:
 
 # NEW: Check for auto-transcription triggers
 def check_auto_transcription_triggers():
+    # One job at a time per student; a due checkpoint fires once the current job is collected
+    if st.session_state.transcription_job is not None:
+        return
     now = time.time()
     elapsed = now - st.session_state.assessment_started_at
 
@@ -299,10 +414,19 @@ def check_auto_transcription_triggers():
         perform_auto_transcription("60 minutes")
         st.rerun()
 
+    # Between checkpoints, keep streamed audio transcribed so the work is spread over the hour
+    elif USE_SEGMENTED_RECORDER and \
+            st.session_state.segment_buffer.pending_sec(_transcribed_frame()) >= ROLLING_TRANSCRIBE_SEC:
+        try:
+            start_transcription_job("rolling", final=False, want_nudge=False)
+        except Exception as e:
+            st.warning(f"Background transcription could not start: {e}")
+
 
 phase, remaining_sec = get_phase_and_remaining()
 
-# NEW: Check auto-transcription triggers before rendering
+# Pick up a finished background job, then check auto-transcription triggers before rendering
+collect_transcription_job()
 check_auto_transcription_triggers()
 
 # -------------------- NEW: Prepare latest nudge text per checkpoint --------------------
@@ -431,6 +555,22 @@ components.html(f"""
 </script>
 """, height=260)  # slightly taller to fit the extra 1-minute alert
 
+# "single" streams one answer for the whole rubric; "per_concept" grades concepts in parallel
+GRADING_MODE = str(st.secrets.get("GRADING_MODE", "single")).lower()
+
+def _stream_grading_text(response, started: float, timing: dict):
+    """Yield text chunks from a streamed response, recording ms to first token and in total."""
+    for chunk in response:
+        try:
+            piece = chunk.text
+        except ValueError:
+            continue   # chunk without text parts (e.g. only finish/safety metadata)
+        if piece and "ttft_ms" not in timing:
+            timing["ttft_ms"] = round((time.perf_counter() - started) * 1000)
+        yield piece
+    timing["total_ms"] = round((time.perf_counter() - started) * 1000)
+    logger.info("grading stream: first token %s ms, total %s ms", timing.get("ttft_ms"), timing["total_ms"])
+
 def _uk(base: str) -> str:
     """Unique widget keys per user to avoid collisions."""
     return f"{base}_{st.session_state.get('visitor_id_input') or 'anon'}"
@@ -444,6 +584,7 @@ def _submit_answer():
         return
 
     with st.spinner("Saving your response..."):
+        collect_transcription_job(wait_sec=SUBMIT_WAIT_SEC)
         try:
             payload = {
                 "student_name": st.session_state.get("visitor_id_input"),
@@ -451,16 +592,18 @@ def _submit_answer():
                 "student_prompt": st.session_state.student_prompt_text,
                 "grade_json": {"text": st.session_state.grade_feedback} if st.session_state.grade_feedback else None,
             }
-            data = insert_submission(payload)
-            if data:
-                st.success("Answer submitted and saved to Supabase!")
-            else:
-                st.warning("Submission saved locally, but Supabase didn't return a row. Check RLS/policies.")
+            submit_submission(payload)  # journaled locally; delivered to Supabase in the background
+            st.success("Answer submitted! It will sync to Supabase shortly.")
         except Exception as e:
-            st.error(f"Failed to save to Supabase: {e}")
+            st.error(f"Failed to save your submission: {e}")
+            return  # keep the student's work in the session so they can retry
 
         # Reset
         st.session_state.recorded_audio_bytes = None
+        st.session_state.recorded_audio_id = None
+        st.session_state.transcription_progress = {"recording_id": None, "frame": 0}
+        st.session_state.segment_buffer.reset()
+        st.session_state.transcription_job = None
         st.session_state.edited_transcription_text = ""
         st.session_state.student_prompt_text = ""
         st.session_state.show_editor = False
@@ -490,15 +633,35 @@ with col_right:
 
     # ----- Recording (only in 'active') -----
     st.subheader("3. Record Your Response")
-    if phase == 'active':
+    if USE_SEGMENTED_RECORDER:
+        # Rendered in every phase so the recorder stops itself (and sends its last segment) at time-up
+        buf = st.session_state.segment_buffer
+        segment_recorder(
+            buf,
+            key=_uk('segment_recorder'),
+            start_prompt="Click to Start Recording",
+            stop_prompt="Click to Stop Recording",
+            disabled=(phase != 'active'),
+        )
+        if buf.total_sec:
+            st.session_state.show_editor = True
+            status = f"{'🔴 Recording · ' if buf.recording else '🎙️ '}{buf.total_sec:.0f}s recorded · {buf.pending_sec(_transcribed_frame()):.0f}s awaiting transcription"
+            if buf.dropped_sec:
+                status += f" · {buf.dropped_sec:.0f}s dropped (buffer full)"
+            st.caption(status)
+        if phase != 'active':
+            st.info("Recording disabled (time limit reached). You may still transcribe existing audio and submit during the 1-minute grace period.")
+    elif phase == 'active':
         recorded_audio_output = mic_recorder(
             start_prompt="Click to Start Recording",
             stop_prompt="Click to Stop Recording",
             use_container_width=True,
+            format="wav",  # PCM, so checkpoints can slice out just the new audio
             key=_uk('audio_recorder')
         )
         if recorded_audio_output and recorded_audio_output.get('bytes'):
             st.session_state.recorded_audio_bytes = recorded_audio_output['bytes']
+            st.session_state.recorded_audio_id = recorded_audio_output.get('id')
             st.audio(st.session_state.recorded_audio_bytes, format="audio/wav")
             st.info("Recorded audio ready for transcription.")
             st.session_state.show_editor = True
@@ -522,45 +685,47 @@ with col_right:
 
     # ----- Transcription (allowed in 'active' and 'grace') -----
     st.subheader("4. Transcribe Your Response")
-    transcribe_disabled = (phase == 'locked') or (st.session_state.recorded_audio_bytes is None)
+    job_running = st.session_state.transcription_job is not None
+    transcribe_disabled = (phase == 'locked') or not _has_audio() or job_running
     if st.button("Manual Transcribe", disabled=transcribe_disabled, key=_uk("transcribe_btn")):
-        if st.session_state.recorded_audio_bytes is None:
+        if not _has_audio():
             st.warning("No recording found to transcribe.")
         else:
-            with st.spinner("Manually transcribing your audio..."):
-                try:
-                    mime_type = "audio/wav"
-                    audio_io = io.BytesIO(st.session_state.recorded_audio_bytes)
-                    audio_file = genai.upload_file(
-                        path=audio_io,
-                        mime_type=mime_type,
-                    )
-                    # Poll until processed
-                    while getattr(audio_file, "state", None) and getattr(audio_file.state, "name", "") == "PROCESSING":
-                        st.info("File is still processing on Gemini's side...")
-                        time.sleep(1)
-                        audio_file = genai.get_file(audio_file.name)
-
-                    prompt = "Transcribe the given audio accurately. Provide only the spoken text."
-                    model = genai.GenerativeModel('models/gemini-1.5-flash-latest')
-                    response = model.generate_content([audio_file, prompt])
-                    transcription_text = response.text or ""
-                    st.session_state.edited_transcription_text = transcription_text
-
-                except GoogleAPIError as api_err:
-                    st.error(f"Gemini API Error: {api_err.message}")
-                    st.info("Please check your API key validity, ensure billing is enabled, or audio is not too long.")
-                    st.exception(api_err)
-                except Exception as e:
-                    st.error(f"An unexpected error occurred during transcription: {e}")
-                    st.exception(e)
+            try:
+                # Send whatever hasn't been transcribed yet, through the end of the recording
+                start_transcription_job("manual", final=True, want_nudge=False)
+                job_running = True
+            except Exception as e:
+                st.error(f"Could not start transcription: {e}")
+
+    if job_running:
+        @st.fragment(run_every=JOB_POLL_SEC)
+        def _watch_transcription_job():
+            job = st.session_state.get("transcription_job")
+            if job is None:
+                return
+            st.caption(f"⏳ Transcribing ({job['reason']}) in the background — you can keep working.")
+            if get_transcription_jobs().done(job["id"]):
+                st.rerun()
+
+        _watch_transcription_job()
+
+    last_upload = st.session_state.transcription_progress.get("last_upload")
+    if last_upload:
+        st.caption(
+            f"Last upload: {last_upload['output_bytes'] / 1024:,.0f} KB {last_upload['mime_type']} "
+            f"from {last_upload['input_bytes'] / 1024:,.0f} KB recorded "
+            f"({last_upload['input_sec']:.0f}s of audio, {last_upload['output_sec']:.0f}s after trimming pauses)"
+        )
 
     # ----- Read-only transcript view -----
     if st.session_state.edited_transcription_text:
         st.info("Transcription")
-        st.session_state.edited_transcription_text = st.text_area(
+        # Read-only, so the widget mirrors the transcript instead of feeding it back;
+        # otherwise its remembered value would overwrite text appended by a background job
+        st.session_state.transcription_editor = st.session_state.edited_transcription_text
+        st.text_area(
             "Your transcribed thoughts (read-only):",
-            value=st.session_state.edited_transcription_text,
             height=200,
             key="transcription_editor",
             disabled=True
@@ -579,131 +744,66 @@ with col_right:
 
     # ----- Combined Grade + Submit (new button) -----
 if st.button("Submit Response", key=_uk("submit_and_grade_button"), disabled=(phase == 'locked')):
-    if not st.session_state.student_prompt_text.strip():
+    # A submission with nothing in it still goes through: the front layer records the
+    # rubric's "missing submission" grade without a model call. Only a reflection
+    # without a final prompt is sent back, since that is usually a forgotten field.
+    if not st.session_state.student_prompt_text.strip() and not is_empty_submission(
+            st.session_state.edited_transcription_text, st.session_state.student_prompt_text):
         st.warning("Final prompt cannot be empty.")
     else:
         with st.spinner("Grading and submitting your assessment..."):
+            collect_transcription_job(wait_sec=SUBMIT_WAIT_SEC)
             try:
-                grading_model = genai.GenerativeModel('models/gemini-1.5-flash-latest')
-
-                student_thoughts = st.session_state.edited_transcription_text
-                student_final_prompt = st.session_state.student_prompt_text
-
-                # ---- Prompt build  ----
-                course_name = "Generative AI Skill-Building"
-                course_goals = "to learn how to use and evaluate AI models"
-                key_concepts = "Prompt Engineering, Prompt Workflow, Evaluation Metrics"
-
-                assessment_summary = '''
-Create a Prompt Engineering Workflow to generate personalized Human Bingo squares that facilitate meaningful connections between participants based on their survey responses.
-
-Requirements:
-- Generate 6 general squares (3 popular themes, 3 niche themes)
-- Create up to 3 personalized squares per participant
-- Use LLM prompts to extract themes and match participants
-- Include evaluation metrics for assessing output quality
-'''
-
-                assessment_reflection_instructions = '''The student reflections should cover the following:
-• a brief outline of initial thoughts about how they might break down the task,
-• discussion of how they created and initial prompt how they plan to iterate on it next based on results,
-• initial thoughts on evaluation metrics they will use to evaluate results of their prompts.'''
-
-                purpose = f'''You are a Teaching Assistant and you will be evaluating student submissions based on a given rubric. Students are taking part in a {course_name} course to {course_goals}. This includes learning the key concepts of {key_concepts}. If a student's submission does not include anything to grade (empty submission) then provide 0s for all the concepts and say "missing submission" for the reasoning since every student still requires a grade.'''
-
-                assessment_details = f'''Students were given an assessment where they had to solve a complex problem to test their understanding of {key_concepts}.
-Students were required to submit both their initial thoughts/reflections on how they plan to tackle the problem AND their final prompt/solution.
-{assessment_reflection_instructions}'''
-
-                model_instructions = '''Your task is to evaluate both the student's initial thoughts/reflections AND their final prompt/solution to assess their understanding of key concepts given in the rubric below. Consider both components when grading: '''
-
-                rubric_json = {
-                    "Prompt Engineering": {"Description": "utilizes clear instructions, examples, formatting requirements and other best practices to design effective prompts.",
-                        "Grades": {
-                            "Missing (0%)": "No prompts are designed.",
-                            "Major Misconceptions (50%)": "Prompts poorly designed with short or unclear instructions; no formatting requirements; few examples; no step-by-step guidance.",
-                            "Nearly Proficient (80%)": "Prompts designed with some clarity, but instructions, formatting requirements, or examples may be irrelevant or lack important details.",
-                            "Proficient (100%)": "Prompts well-designed with clear instructions, relevant examples, and logical step-by-step thinking.",
-                            "Mastery (102%)": "Prompts exceptionally well-designed with clear instructions, highly relevant examples, and comprehensive step-by-step guidance."
-                        }
-                    },
-                    "Prompt Workflow Breakdown": {"Description": "demonstrates clear step-by-step thinking to effectively break down into a series of prompts.",
-                        "Grades": {
-                            "Missing (0%)": "Problem not broken down into steps/prompts.",
-                            "Major Misconceptions (50%)": "Breakdown poorly designed with very few or irrelevant steps.",
-                            "Nearly Proficient (80%)": "Workflow has some steps/clarity, but may lack important details.",
-                            "Proficient (100%)": "Workflow well-designed with clear instructions and logical step-by-step thinking.",
-                            "Mastery (102%)": "Workflow exceptionally well-designed with comprehensive step-by-step breakdown."
-                        }
-                    },
-                    "Evaluation Metrics": {"Description": "defines metrics that are well-defined and relevant to the problem",
-                        "Grades": {
-                            "Missing (0%)": "No metrics defined.",
-                            "Major Misconceptions (50%)": "Not enough metrics or not applicable to context.",
-                            "Nearly Proficient (80%)": "Metrics defined but may lack clarity or relevance.",
-                            "Proficient (100%)": "Metrics are well designed; applicable and insightful.",
-                            "Mastery (102%)": "Metrics fully defined with perfect clarity; applicable and insightful."
-                        }
-                    }
-                }
-
-                rubric_instructions = f'''For each of the three key concepts in the rubric: {key_concepts}, assign the student one of the Grades between Missing, Major Misconceptions, Nearly Proficient, Proficient, Mastery based on their understanding. Ensure the grades directly reflect the strengths and weaknesses identified in the critiques.'''
-
-                expected_output_format = '''
-Assessment Scores:
-
-Concept: [Concept Name]
-Grade: [Grade]
-Reasoning: [Rationale for score]
-
-Concept: [Concept Name]
-Grade: [Grade]
-Reasoning: [Rationale for score]
-
-Concept: [Concept Name]
-Grade: [Grade]
-Reasoning: [Rationale for score]
-'''
-
-                expected_output_examples = '(Examples omitted for brevity)'
-
-                master_prompt = f'''
-Purpose: {purpose}
-
-Assessment Context: {assessment_details}
-
-{model_instructions}
+                clients = get_gemini_clients(st.session_state.get("api_key"))
 
-Rubric: {rubric_json}
+                # Long submissions are shrunk to the grading token budget; the full text is still stored
+                student_thoughts, student_final_prompt, prompt_tokens = fit_submission(
+                    st.session_state.edited_transcription_text, st.session_state.student_prompt_text)
+                logger.info("grading prompt tokens: %s", prompt_tokens)
 
-{rubric_instructions}
-
-Output Format
-Use the following output format to output your results:
-{expected_output_format}
-
-Students Assessment Problem Statement:
-Here is the problem statement that was given to the students:
-{assessment_summary}
-
-Here are 3 examples of student submissions and their assessments:
-{expected_output_examples}
-
-Student Submission:
-
-STUDENT'S INITIAL THOUGHTS/REFLECTIONS:
-{student_thoughts}
-
-STUDENT'S FINAL PROMPT/SOLUTION:
-{student_final_prompt}
-'''
-
-                if 'grade_shown' not in st.session_state:
-                    st.session_state.grade_shown = False
+                master_prompt = build_master_prompt(student_thoughts, student_final_prompt)
 
                 st.session_state.grading_prompt_text = master_prompt
-                grading_response = grading_model.generate_content(master_prompt)
-                st.session_state.grade_feedback = grading_response.text
+                grade_json = {**grade_provenance(st.session_state.edited_transcription_text,
+                                                 st.session_state.student_prompt_text),
+                              "prompt_tokens": prompt_tokens}
+                stream_box = st.empty()
+                # Empty submissions and exact resubmissions are answered without a model call
+                grading_front = get_grading_front()
+                local_grade = grading_front.lookup(st.session_state.edited_transcription_text,
+                                                   st.session_state.student_prompt_text)
+                if local_grade:
+                    st.session_state.grade_feedback = local_grade["text"]
+                    timing = {}
+                    grade_json["source"] = local_grade["source"]
+                elif GRADING_MODE == "per_concept":
+                    # One request per rubric concept, shown as each one finishes
+                    with stream_box.container():
+                        st.subheader("Gemini Evaluation:")
+                        partial_box = st.empty()
+                    result = grade_per_concept(clients, student_thoughts, student_final_prompt,
+                                               on_progress=partial_box.info)
+                    st.session_state.grade_feedback = result["text"]
+                    timing = result["timing"]
+                    if result["ungraded"]:
+                        grade_json["ungraded"] = result["ungraded"]
+                else:
+                    # Stream the evaluation into the page as it arrives; it is stored once complete
+                    timing = {}
+                    with stream_box.container():
+                        st.subheader("Gemini Evaluation:")
+                        grading_started = time.perf_counter()
+                        # Only the student's part is sent when the static prefix is context-cached
+                        grading_model, request_prompt, grade_json["prefix_cached"] = grading_request(
+                            clients, MASTER_PREFIX, student_thoughts, student_final_prompt)
+                        grading_response = grading_model.generate_content(request_prompt, stream=True)
+                        st.session_state.grade_feedback = st.write_stream(
+                            _stream_grading_text(grading_response, grading_started, timing))
+                stream_box.empty()   # shown again, complete, in the Grade feedback section below
+                if st.session_state.grade_feedback and not local_grade and not grade_json.get("ungraded"):
+                    grading_front.remember(st.session_state.edited_transcription_text,
+                                           st.session_state.student_prompt_text, st.session_state.grade_feedback)
+                st.session_state.grade_timing = timing
                 st.session_state.grade_shown = True  # NEW
 
                 # Submit to Supabase
@@ -711,13 +811,10 @@ STUDENT'S FINAL PROMPT/SOLUTION:
                     "student_name": st.session_state.get("visitor_id_input"),
                     "transcript_text": st.session_state.edited_transcription_text,
                     "student_prompt": st.session_state.student_prompt_text,
-                    "grade_json": {"text": st.session_state.grade_feedback},
+                    "grade_json": {"text": st.session_state.grade_feedback, "timing": timing, **grade_json},
                 }
-                data = insert_submission(payload)
-                if data:
-                    st.success("✅ Assessment graded and submitted!")
-                else:
-                    st.warning("⚠️ Graded response saved locally, but Supabase did not return a confirmation. Check Supabase policies or rules.")
+                submit_submission(payload)  # journaled locally; delivered to Supabase in the background
+                st.success("✅ Assessment graded and submitted!")
             except Exception as e:
                 st.error(f"❌ Failed to grade and submit assessment: {e}")
                 st.exception(e)
@@ -727,6 +824,10 @@ STUDENT'S FINAL PROMPT/SOLUTION:
 if st.session_state.grade_shown and st.session_state.grade_feedback:
     st.subheader("Gemini Evaluation:")
     st.info(st.session_state.grade_feedback)
+    timing = st.session_state.grade_timing
+    if timing and "total_ms" in timing:
+        st.caption(f"First words after {timing.get('ttft_ms', timing['total_ms']) / 1000:.1f}s · "
+                   f"complete after {timing['total_ms'] / 1000:.1f}s")
 
 
 
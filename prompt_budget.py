@@ -0,0 +1,159 @@
+import bisect
+import math
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# ---------------------------
+# Token budgets for prompts
+# ---------------------------
+# A prompt is a list of named sections. Fixed sections (instructions, templates) are
+# always kept whole; shrinkable ones (transcripts, student text) share what is left
+# of the budget and are cut down deterministically when they don't fit, so request
+# size and latency stay bounded however long a student talks. Tokens are estimated
+# locally (Gemini's countTokens is a network round trip); the estimate runs a little
+# high for English, so budgets err on the safe side.
+
+CHARS_PER_TOKEN = 4
+SHRINK_STRATEGIES = ("head", "tail", "head_tail", "extract")
+
+_PIECE = re.compile(r"\S+\s*")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"[a-z0-9']{4,}")   # short words are mostly filler, so they don't score
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _omitted(n_words: int) -> str:
+    return f"[... {n_words} words omitted to fit the length limit ...]"
+
+def _largest_fit(n: int, build: Callable[[int], str], budget: int, count: Callable[[str], int]) -> str:
+    """build(k) for the largest k in [0, n] whose result fits budget (build must grow with k)."""
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count(build(mid)) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return build(lo)
+
+def _shrink_window(text: str, budget: int, strategy: str, count: Callable[[str], int]) -> str:
+    pieces = _PIECE.findall(text)
+    n = len(pieces)
+
+    def build(k: int) -> str:
+        if strategy == "head":
+            return "".join(pieces[:k]).rstrip() + "\n" + _omitted(n - k)
+        if strategy == "tail":
+            return _omitted(n - k) + "\n" + "".join(pieces[n - k:])
+        head = k // 2
+        return ("".join(pieces[:head]).rstrip() + "\n" + _omitted(n - k) + "\n"
+                + "".join(pieces[n - (k - head):]))
+
+    return _largest_fit(n, build, budget, count)
+
+def _shrink_extract(text: str, budget: int, count: Callable[[str], int]) -> str:
+    """Extractive summary: the sentences whose words recur most, kept in their original order."""
+    sentences = [s for s in _SENTENCE_END.split(text.strip()) if s]
+    if len(sentences) < 2:
+        # No sentence punctuation (common in raw speech): keep both ends, mark the middle
+        return _shrink_window(text, budget, "head_tail", count)
+    freq = Counter(_WORD.findall(text.lower()))
+
+    def score(i: int) -> float:
+        words = _WORD.findall(sentences[i].lower())
+        return sum(freq[w] for w in words) / math.sqrt(len(words)) if words else 0.0
+
+    # First and last sentences anchor the summary; ties go to the earlier sentence
+    order = [0, len(sentences) - 1] + sorted(range(1, len(sentences) - 1), key=lambda i: (-score(i), i))
+
+    pieces = [0]
+    for sentence in sentences:
+        pieces.append(pieces[-1] + len(_PIECE.findall(sentence)))
+
+    def gap(a: int, b: int) -> List[str]:
+        """Marker for the sentences strictly between chosen a and b (none if adjacent)."""
+        return [_omitted(pieces[b] - pieces[a + 1])] if b > a + 1 else []
+
+    def render(chosen: List[int]) -> str:
+        out, previous = [], -1
+        for i in chosen:
+            out += gap(previous, i) + [sentences[i]]
+            previous = i
+        return " ".join(out + gap(previous, len(sentences)))
+
+    def cost(parts: List[str]) -> int:
+        return sum(count(part) + 1 for part in parts)
+
+    # Greedy by score, tracking the size change of each pick (its sentence plus the
+    # markers it splits a gap into) instead of re-rendering the whole summary
+    chosen: List[int] = []
+    total = cost(gap(-1, len(sentences)))
+    for i in dict.fromkeys(order):   # de-duplicates a one-sentence text
+        at = bisect.bisect(chosen, i)
+        before = chosen[at - 1] if at else -1
+        after = chosen[at] if at < len(chosen) else len(sentences)
+        delta = cost(gap(before, i) + [sentences[i]] + gap(i, after)) - cost(gap(before, after))
+        if total + delta <= budget:
+            chosen.insert(at, i)
+            total += delta
+    # Estimates can round differently on the joined text; drop the lowest-ranked picks until it fits
+    ranked = [i for i in dict.fromkeys(order) if i in set(chosen)]
+    while chosen and count(render(chosen)) > budget:
+        chosen.remove(ranked.pop())
+    return render(chosen) if chosen else _shrink_window(text, budget, "head_tail", count)
+
+def shrink(text: str, budget: int, strategy: str = "head_tail",
+           count: Callable[[str], int] = estimate_tokens) -> str:
+    """text cut down to at most budget tokens (unchanged if it already fits)."""
+    if strategy not in SHRINK_STRATEGIES:
+        raise ValueError(f"Unknown shrink strategy: {strategy}")
+    if count(text) <= budget:
+        return text
+    if strategy == "extract":
+        return _shrink_extract(text, budget, count)
+    return _shrink_window(text, budget, strategy, count)
+
+
+class Section:
+    """One named part of a prompt; shrink=None keeps it whole."""
+
+    def __init__(self, name: str, text: str, shrink: Optional[str] = None):
+        self.name = name
+        self.text = text
+        self.shrink = shrink
+
+
+def fit_sections(sections: List[Section], budget: int,
+                 count: Callable[[str], int] = estimate_tokens) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """Fit sections into budget tokens. Returns ({name: text}, report).
+
+    Shrinkable sections smaller than an equal share of the room left by the fixed
+    ones keep everything; the larger ones split the rest equally. report is
+    {"budget", "total_tokens", "sections": {name: {"tokens", "original_tokens", "shrunk"}}}.
+    """
+    sizes = {s.name: count(s.text) for s in sections}
+    room = max(0, budget - sum(sizes[s.name] for s in sections if not s.shrink))
+    allowed: Dict[str, int] = {}
+    pending = sorted((s for s in sections if s.shrink), key=lambda s: sizes[s.name])
+    while pending:
+        share = room // len(pending)
+        if sizes[pending[0].name] > share:
+            allowed.update((s.name, share) for s in pending)
+            break
+        section = pending.pop(0)
+        allowed[section.name] = sizes[section.name]
+        room -= sizes[section.name]
+
+    texts: Dict[str, str] = {}
+    report: Dict[str, Any] = {"budget": budget, "total_tokens": 0, "sections": {}}
+    for s in sections:
+        fits = s.name not in allowed or sizes[s.name] <= allowed[s.name]
+        texts[s.name] = s.text if fits else shrink(s.text, allowed[s.name], s.shrink, count)
+        tokens = sizes[s.name] if fits else count(texts[s.name])
+        report["sections"][s.name] = {"tokens": tokens, "original_tokens": sizes[s.name],
+                                      "shrunk": None if fits else s.shrink}
+        report["total_tokens"] += tokens
+    return texts, report
@@ -0,0 +1,72 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable
+
+# ---------------------------
+# Process-wide read cache shared by every Streamlit session
+# ---------------------------
+
+class QueryCache:
+    """TTL cache with explicit invalidation and single-flight fetches.
+
+    Sessions asking for the same key at the same time share one fetch: the first
+    caller runs it while the others wait on the key's lock and then read the result.
+    invalidate() bumps a generation counter so a fetch that was already in flight
+    when the data changed is not stored. A key's lock only exists while someone is
+    fetching or waiting on it, so the lock table stays as small as the traffic.
+    """
+
+    def __init__(self, ttl_sec: float):
+        self.ttl_sec = ttl_sec
+        self._entries: Dict[Hashable, tuple] = {}      # key -> (expires_at, value)
+        self._key_locks: Dict[Hashable, list] = {}     # key -> [lock, callers using it]
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry
+        return None
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._fresh(key)
+            if entry:
+                self.hits += 1
+                return entry[1]
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                with self._lock:
+                    entry = self._fresh(key)   # filled by a concurrent caller while we waited
+                    if entry:
+                        self.hits += 1
+                        return entry[1]
+                    self.misses += 1
+                    generation = self._generation
+                value = fetch()
+                with self._lock:
+                    if generation == self._generation:
+                        now = time.monotonic()
+                        # Drop expired entries too, so keys that are never read again don't pile up
+                        self._entries = {k: e for k, e in self._entries.items() if e[0] > now}
+                        self._entries[key] = (now + self.ttl_sec, value)
+                return value
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[key]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
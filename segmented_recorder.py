@@ -0,0 +1,109 @@
+import base64
+import io
+import os
+import uuid
+import wave
+from typing import Any, Dict, Optional
+
+import streamlit.components.v1 as components
+
+# ---------------------------
+# Rolling segmented recording
+# ---------------------------
+# The recorder component (recorder_component/index.html) sends 16 kHz mono PCM every
+# SEGMENT_SEC while the student keeps talking. Segments are appended to a per-student
+# SegmentBuffer, so checkpoints can transcribe up-to-date audio without a Stop click.
+# Audio already transcribed is discarded, and untranscribed audio is capped at
+# MAX_PENDING_SEC (oldest dropped first) so one session can't grow without bound.
+
+SEGMENT_SEC = 20
+SEGMENT_SAMPLE_RATE = 16000
+MAX_PENDING_SEC = 20 * 60
+
+_segment_recorder = components.declare_component(
+    "segment_recorder", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorder_component"))
+
+
+class SegmentBuffer:
+    """Contiguous 16-bit mono PCM assembled from recorder segments, addressed by absolute frame."""
+
+    def __init__(self, sample_rate: int = SEGMENT_SAMPLE_RATE, max_pending_sec: float = MAX_PENDING_SEC):
+        self.recording_id = uuid.uuid4().hex   # one continuous timeline across Start/Stop sessions
+        self.sample_rate = sample_rate
+        self.max_pending_sec = max_pending_sec
+        self.base = 0                          # absolute frame of _pcm[0]
+        self.dropped_sec = 0.0
+        self.acked: Dict[str, int] = {}        # recorder session -> last seq appended
+        self.recording = False
+        self._pcm = bytearray()
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self._pcm) // 2
+
+    @property
+    def total_sec(self) -> float:
+        return self.end / self.sample_rate
+
+    def pending_sec(self, since_frame: int) -> float:
+        return max(0, self.end - max(since_frame, self.base)) / self.sample_rate
+
+    def add(self, value: Optional[Dict[str, Any]]) -> int:
+        """Append new segments from a recorder value (re-sent ones are ignored). Returns how many."""
+        if not value or not value.get("session"):
+            return 0
+        if int(value.get("sample_rate", self.sample_rate)) != self.sample_rate:
+            raise ValueError("Recorder sample rate changed mid-assessment")
+        session = value["session"]
+        added = 0
+        for segment in sorted(value.get("segments", []), key=lambda s: s["seq"]):
+            if segment["seq"] <= self.acked.get(session, -1):
+                continue
+            self._pcm += base64.b64decode(segment["pcm_b64"])
+            self.acked[session] = segment["seq"]
+            added += 1
+        self.recording = not value.get("stopped", False)
+        self._enforce_limit()
+        return added
+
+    def wav_since(self, frame: int) -> bytes:
+        """WAV of everything from absolute frame (clamped to what is still buffered) to the end."""
+        start = (max(frame, self.base) - self.base) * 2
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(bytes(self._pcm[start:]))
+        return buf.getvalue()
+
+    def discard_before(self, frame: int) -> None:
+        """Free audio that has been transcribed."""
+        cut = min(max(0, frame - self.base), len(self._pcm) // 2)
+        del self._pcm[:cut * 2]
+        self.base += cut
+
+    def _enforce_limit(self) -> None:
+        excess = len(self._pcm) // 2 - int(self.max_pending_sec * self.sample_rate)
+        if excess > 0:
+            self.discard_before(self.base + excess)
+            self.dropped_sec += excess / self.sample_rate
+
+    def reset(self) -> None:
+        """Start a new timeline. acked is kept so the recorder's last value isn't re-added."""
+        self.recording_id = uuid.uuid4().hex
+        self.base = 0
+        self.dropped_sec = 0.0
+        self._pcm = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._pcm) // 2
+
+
+def segment_recorder(buffer: SegmentBuffer, key: str, start_prompt: str = "Start Recording",
+                     stop_prompt: str = "Stop Recording", disabled: bool = False) -> int:
+    """Render the rolling recorder and append any new segments to buffer. Returns segments added."""
+    value = _segment_recorder(
+        segment_sec=SEGMENT_SEC, sample_rate=buffer.sample_rate, acked=buffer.acked,
+        start_prompt=start_prompt, stop_prompt=stop_prompt, disabled=disabled, key=key, default=None)
+    return buffer.add(value)
@@ -0,0 +1,30 @@
+-- Per-student submission summary used by the admin dashboard and Edit Grades page.
+-- Run once in the Supabase SQL editor.
+
+-- Keyset paging (created_at, id) and per-student lookups
+create index if not exists submissions_created_at_id_idx
+    on submissions (created_at desc, id desc);
+create index if not exists submissions_student_created_at_idx
+    on submissions (student_name, created_at desc, id desc);
+
+-- One row per student: submission count, latest submission time and whether
+-- the latest submission has a grade. security_invoker keeps RLS on submissions.
+create or replace view student_submission_summary
+with (security_invoker = on) as
+select
+    s.student_name,
+    s.submission_count,
+    s.latest_created_at,
+    case when latest.grade_json is null then 'ungraded' else 'graded' end as latest_grade_status
+from (
+    select student_name, count(*) as submission_count, max(created_at) as latest_created_at
+    from submissions
+    group by student_name
+) s
+cross join lateral (
+    select grade_json
+    from submissions
+    where submissions.student_name = s.student_name
+    order by created_at desc, id desc
+    limit 1
+) latest;
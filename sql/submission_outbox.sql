@@ -0,0 +1,6 @@
+-- Idempotency key for submissions delivered by the local outbox (submission_outbox.py).
+-- A retried batch upserts with on_conflict=idempotency_key / ignore duplicates,
+-- so each journaled submission lands in the table exactly once.
+alter table submissions add column if not exists idempotency_key text;
+create unique index if not exists submissions_idempotency_key_idx
+    on submissions (idempotency_key);
@@ -0,0 +1,2 @@
+-- Push inserts/updates on submissions over Supabase Realtime (submission_feed.py).
+alter publication supabase_realtime add table submissions;
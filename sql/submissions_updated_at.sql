@@ -0,0 +1,21 @@
+-- updated_at watermark for the admin dashboard's delta sync (submission_mirror.py).
+alter table submissions add column if not exists updated_at timestamptz;
+update submissions set updated_at = created_at where updated_at is null;
+alter table submissions alter column updated_at set default now();
+alter table submissions alter column updated_at set not null;
+
+create or replace function submissions_touch_updated_at() returns trigger
+language plpgsql as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists submissions_touch_updated_at on submissions;
+create trigger submissions_touch_updated_at
+    before update on submissions
+    for each row execute function submissions_touch_updated_at();
+
+create index if not exists submissions_updated_at_id_idx
+    on submissions (updated_at, id);
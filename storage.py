@@ -0,0 +1,423 @@
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional, Tuple
+
+import streamlit as st
+from submission_feed import ANON_SCOPE, publish_changes
+
+# ---------------------------
+# Storage backends
+# ---------------------------
+# Pages and background workers go through get_storage() instead of talking to
+# Supabase directly. STORAGE_BACKEND in secrets picks the implementation:
+#   "supabase" (default) - the hosted database, via supabase_client
+#   "sqlite"             - an embedded WAL-mode database file, for on-prem pilots
+#                          and offline load tests (SQLITE_PATH sets the file)
+
+SUBMISSION_LIST_COLUMNS = "id, student_name, transcript_text, grade_json, created_at"
+DEFAULT_PAGE_SIZE = 50
+
+Cursor = Tuple[str, Any]   # (timestamp, id) of the last row on the previous page
+
+
+class StorageBackend(ABC):
+    """Everything the app reads or writes. Page results are {"rows", "next_cursor"}.
+
+    A backend missing any abstract method fails when it is created, not mid-request.
+    """
+
+    # ----- submissions -----
+    @abstractmethod
+    def insert_submission(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def insert_submissions_batch(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert many rows; rows whose idempotency_key already exists are skipped."""
+
+    @abstractmethod
+    def get_submissions_page(self, columns: str = SUBMISSION_LIST_COLUMNS, page_size: int = DEFAULT_PAGE_SIZE,
+                             cursor: Optional[Cursor] = None, student_name: Optional[str] = None) -> Dict[str, Any]:
+        """Newest first, keyset-paged on (created_at, id)."""
+
+    @abstractmethod
+    def get_submissions_changed_since(self, since: Optional[str] = None, columns: str = SUBMISSION_LIST_COLUMNS,
+                                      page_size: int = 500, cursor: Optional[Cursor] = None) -> Dict[str, Any]:
+        """Oldest change first, keyset-paged on (updated_at, id)."""
+
+    @abstractmethod
+    def count_submissions(self) -> int:
+        ...
+
+    @abstractmethod
+    def get_student_summaries(self) -> List[Dict[str, Any]]:
+        """One row per student: submission_count, latest_created_at, latest_grade_status."""
+
+    @abstractmethod
+    def update_grade(self, submission_id: Any, grade: Any) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def bulk_update_grades(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """rows: [{"id", "student_name", "grade_json"}]. Returns {"updated": {id: row}, "failed": {id: error}}."""
+
+    # ----- assignments -----
+    @abstractmethod
+    def upsert_assignment(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    # ----- auth -----
+    @abstractmethod
+    def sign_up(self, email: str, password: str):
+        ...
+
+    @abstractmethod
+    def sign_in(self, email: str, password: str):
+        ...
+
+    @abstractmethod
+    def end_admin_session(self) -> None:
+        ...
+
+    @abstractmethod
+    def check_health(self) -> Dict[str, Any]:
+        ...
+
+    def auth_scope(self) -> str:
+        """Whose permissions this session's reads run under. Anything cached across sessions
+        must be keyed by it; backends without row-level security have just the one scope."""
+        return ANON_SCOPE
+
+    def cache_stats(self) -> Optional[Dict[str, int]]:
+        """Shared read cache counters {"hits", "misses", "entries"}, or None without a cache."""
+        return None
+
+
+class SupabaseStorage(StorageBackend):
+    """The hosted backend; a thin layer over supabase_client."""
+
+    def __init__(self):
+        import supabase_client
+        self._sc = supabase_client
+        self._anon = supabase_client.get_client()   # for background threads, which have no session
+
+    def insert_submission(self, payload):
+        return self._sc.insert_submission(payload)
+
+    def insert_submissions_batch(self, payloads):
+        return self._sc.insert_submissions_batch(payloads, sb=self._anon)
+
+    def get_submissions_page(self, columns=SUBMISSION_LIST_COLUMNS, page_size=DEFAULT_PAGE_SIZE,
+                             cursor=None, student_name=None):
+        return self._sc.get_submissions_page(columns, page_size, cursor, student_name)
+
+    def get_submissions_changed_since(self, since=None, columns=SUBMISSION_LIST_COLUMNS, page_size=500, cursor=None):
+        return self._sc.get_submissions_changed_since(since, columns, page_size, cursor)
+
+    def count_submissions(self):
+        return self._sc.count_submissions()
+
+    def get_student_summaries(self):
+        return self._sc.get_student_summaries()
+
+    def update_grade(self, submission_id, grade):
+        return self._sc.update_grade(submission_id, grade)
+
+    def bulk_update_grades(self, rows):
+        return self._sc.bulk_update_grades(rows)
+
+    def upsert_assignment(self, payload):
+        return self._sc.upsert_assignment(payload)
+
+    def sign_up(self, email, password):
+        return self._sc.sign_up(email, password)
+
+    def sign_in(self, email, password):
+        return self._sc.sign_in(email, password)
+
+    def end_admin_session(self):
+        self._sc.end_admin_session()
+
+    def check_health(self):
+        return self._sc.check_health()
+
+    def auth_scope(self):
+        return self._sc.auth_scope()
+
+    def cache_stats(self):
+        return self._sc.submissions_cache_stats()
+
+
+# ---------------------------
+# Embedded SQLite backend
+# ---------------------------
+_SQLITE_SCHEMA = """
+create table if not exists submissions (
+    id               integer primary key autoincrement,
+    assignment_id    text,
+    student_name     text not null,
+    transcript_text  text,
+    student_prompt   text,
+    grade_json       text,
+    idempotency_key  text unique,
+    created_at       text not null,
+    updated_at       text not null
+);
+create index if not exists submissions_created_at_id_idx on submissions (created_at desc, id desc);
+create index if not exists submissions_student_created_at_idx on submissions (student_name, created_at desc, id desc);
+create index if not exists submissions_updated_at_id_idx on submissions (updated_at, id);
+
+create table if not exists assignments (
+    id            integer primary key autoincrement,
+    title         text,
+    question_text text,
+    rubric_text   text
+);
+
+create table if not exists admin_users (
+    email         text primary key,
+    salt          text not null,
+    password_hash text not null
+);
+"""
+
+_SUBMISSION_COLUMNS = ("id", "assignment_id", "student_name", "transcript_text", "student_prompt",
+                       "grade_json", "idempotency_key", "created_at", "updated_at")
+_JSON_COLUMNS = ("grade_json",)
+
+def _now() -> str:
+    # Fixed-width UTC ISO strings sort correctly as text
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+def _hash_password(password: str, salt: str) -> str:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), 200_000).hex()
+
+
+class SQLiteStorage(StorageBackend):
+    """Embedded backend: one WAL-mode database file, no network hop."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(_SQLITE_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(columns: str, required: Tuple[str, ...]) -> str:
+        names = [c.strip() for c in columns.split(",")]
+        if "*" in names:
+            return ", ".join(_SUBMISSION_COLUMNS)
+        unknown = [c for c in names if c not in _SUBMISSION_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown submissions column(s): {', '.join(unknown)}")
+        return ", ".join(names + [c for c in required if c not in names])
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict[str, Any]:
+        data = dict(row)
+        for col in _JSON_COLUMNS:
+            if data.get(col) is not None:
+                data[col] = json.loads(data[col])
+        return data
+
+    def _page(self, sql: str, params: list, page_size: int, cursor_cols: Tuple[str, str]) -> Dict[str, Any]:
+        rows = [self._row(r) for r in self._conn().execute(sql, params + [page_size + 1]).fetchall()]
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = (rows[-1][cursor_cols[0]], rows[-1][cursor_cols[1]])
+        return {"rows": rows, "next_cursor": next_cursor}
+
+    def _select_by_ids(self, ids: List[Any]) -> List[Dict[str, Any]]:
+        if not ids:
+            return []
+        marks = ", ".join("?" for _ in ids)
+        rows = self._conn().execute(f"select * from submissions where id in ({marks})", ids).fetchall()
+        return [self._row(r) for r in rows]
+
+    # ----- submissions -----
+    def _insert(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        ids = []
+        conn.execute("begin immediate")
+        try:
+            for payload in payloads:
+                row = {k: v for k, v in payload.items() if k in _SUBMISSION_COLUMNS and k != "id"}
+                for col in _JSON_COLUMNS:
+                    if row.get(col) is not None:
+                        row[col] = json.dumps(row[col])
+                now = _now()
+                row.setdefault("created_at", now)
+                row["updated_at"] = now
+                cols = ", ".join(row)
+                marks = ", ".join("?" for _ in row)
+                cur = conn.execute(
+                    f"insert into submissions ({cols}) values ({marks}) on conflict (idempotency_key) do nothing",
+                    list(row.values()),
+                )
+                if cur.rowcount:
+                    ids.append(cur.lastrowid)
+            conn.execute("commit")
+        except Exception:
+            conn.execute("rollback")
+            raise
+        inserted = self._select_by_ids(ids)
+        publish_changes("INSERT", inserted)
+        return inserted
+
+    def insert_submission(self, payload):
+        return self._insert([payload])
+
+    def insert_submissions_batch(self, payloads):
+        return self._insert(payloads)
+
+    def get_submissions_page(self, columns=SUBMISSION_LIST_COLUMNS, page_size=DEFAULT_PAGE_SIZE,
+                             cursor=None, student_name=None):
+        where, params = [], []
+        if student_name is not None:
+            where.append("student_name = ?")
+            params.append(student_name)
+        if cursor is not None:
+            where.append("(created_at < ? or (created_at = ? and id < ?))")
+            params += [cursor[0], cursor[0], cursor[1]]
+        sql = f"select {self._columns(columns, ('id', 'created_at'))} from submissions"
+        if where:
+            sql += " where " + " and ".join(where)
+        sql += " order by created_at desc, id desc limit ?"
+        return self._page(sql, params, page_size, ("created_at", "id"))
+
+    def get_submissions_changed_since(self, since=None, columns=SUBMISSION_LIST_COLUMNS, page_size=500, cursor=None):
+        sql = f"select {self._columns(columns, ('id', 'updated_at'))} from submissions"
+        params: list = []
+        if cursor is not None:
+            sql += " where (updated_at > ? or (updated_at = ? and id > ?))"
+            params = [cursor[0], cursor[0], cursor[1]]
+        elif since is not None:
+            sql += " where updated_at >= ?"
+            params = [since]
+        sql += " order by updated_at, id limit ?"
+        return self._page(sql, params, page_size, ("updated_at", "id"))
+
+    def count_submissions(self):
+        return self._conn().execute("select count(*) from submissions").fetchone()[0]
+
+    def get_student_summaries(self):
+        rows = self._conn().execute("""
+            select student_name, submission_count, latest_created_at,
+                   case when grade_json is null then 'ungraded' else 'graded' end as latest_grade_status
+            from (
+                select student_name, grade_json, created_at as latest_created_at,
+                       count(*) over (partition by student_name) as submission_count,
+                       row_number() over (partition by student_name order by created_at desc, id desc) as rn
+                from submissions
+            )
+            where rn = 1
+            order by latest_created_at desc
+        """).fetchall()
+        return [dict(r) for r in rows]
+
+    def update_grade(self, submission_id, grade):
+        self._conn().execute(
+            "update submissions set grade_json = ?, updated_at = ? where id = ?",
+            (json.dumps(grade), _now(), submission_id),
+        )
+        rows = self._select_by_ids([submission_id])
+        publish_changes("UPDATE", rows)
+        return rows
+
+    def bulk_update_grades(self, rows):
+        if not rows:
+            return {"updated": {}, "failed": {}}
+        conn = self._conn()
+        now = _now()
+        conn.execute("begin immediate")
+        try:
+            conn.executemany(
+                "update submissions set grade_json = ?, updated_at = ? where id = ?",
+                [(json.dumps(r["grade_json"]), now, r["id"]) for r in rows],
+            )
+            conn.execute("commit")
+        except Exception as e:
+            conn.execute("rollback")
+            return {"updated": {}, "failed": {r["id"]: str(e) for r in rows}}
+        updated = {r["id"]: r for r in self._select_by_ids([r["id"] for r in rows])}
+        failed = {r["id"]: "No such submission." for r in rows if r["id"] not in updated}
+        publish_changes("UPDATE", list(updated.values()))
+        return {"updated": updated, "failed": failed}
+
+    # ----- assignments -----
+    def upsert_assignment(self, payload):
+        row = {k: payload.get(k) for k in ("id", "title", "question_text", "rubric_text") if k in payload}
+        cols = ", ".join(row)
+        marks = ", ".join("?" for _ in row)
+        conn = self._conn()
+        cur = conn.execute(f"insert or replace into assignments ({cols}) values ({marks})", list(row.values()))
+        data = [dict(r) for r in conn.execute("select * from assignments where id = ?", (cur.lastrowid,)).fetchall()]
+        return {"count": len(data), "data": data}
+
+    # ----- auth (local stub: salted PBKDF2 hashes in admin_users) -----
+    def sign_up(self, email, password):
+        salt = secrets.token_hex(16)
+        try:
+            self._conn().execute(
+                "insert into admin_users (email, salt, password_hash) values (?, ?, ?)",
+                (email, salt, _hash_password(password, salt)),
+            )
+        except sqlite3.IntegrityError:
+            st.error("Registration failed: an account with this email already exists.")
+            return None
+        return SimpleNamespace(user=SimpleNamespace(email=email), session=None)
+
+    def sign_in(self, email, password):
+        row = self._conn().execute("select salt, password_hash from admin_users where email = ?", (email,)).fetchone()
+        if row is None or not secrets.compare_digest(_hash_password(password, row["salt"]), row["password_hash"]):
+            st.error("Login failed: invalid email or password.")
+            return None
+        return SimpleNamespace(user=SimpleNamespace(email=email), session=None)
+
+    def end_admin_session(self):
+        pass   # nothing is held server-side
+
+    def check_health(self):
+        try:
+            self._conn().execute("select 1").fetchone()
+            return {"ok": True, "latency_ms": 0.0}
+        except Exception as e:
+            return {"ok": False, "latency_ms": 0.0, "error": str(e)}
+
+
+def storage_backend_name() -> str:
+    return str(st.secrets.get("STORAGE_BACKEND", "supabase")).lower()
+
+@st.cache_resource(show_spinner=False)
+def _get_storage(backend: str, sqlite_path: str) -> StorageBackend:
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_path)
+    if backend == "supabase":
+        return SupabaseStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r} (expected 'supabase' or 'sqlite')")
+
+def get_storage() -> StorageBackend:
+    """The configured backend, shared by the whole process."""
+    return _get_storage(storage_backend_name(),
+                        st.secrets.get("SQLITE_PATH", os.path.join(".data", "blossom.db")))
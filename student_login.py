@@ -3,7 +3,6 @@
 # =========================
 
 import streamlit as st
-import google.generativeai as genai
 import io
 import os
 import sys
@@ -14,7 +13,8 @@ import json
 
 # Fix: add root directory to sys.path so we can import supabase_client
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from supabase_client import insert_submission
+from storage import get_storage
+from gemini_clients import get_gemini_clients
 
 # Set up page config
 st.set_page_config(page_title="Blossom Assessment - Login", layout="wide")
@@ -145,7 +145,7 @@ def _submit_answer():
                 "student_prompt": st.session_state.student_prompt_text,
                 "grade_json": {"text": st.session_state.grade_feedback} if st.session_state.grade_feedback else None,
             }
-            data = insert_submission(payload)
+            data = get_storage().insert_submission(payload)
             if data:
                 st.success("Answer submitted and saved to Supabase!")
             else:
@@ -183,7 +183,8 @@ if not st.session_state.get("api_key_set", False):
                 st.session_state.api_key_status = "error: Please paste your Gemini API key."
             else:
                 try:
-                    genai.configure(api_key=api_key)
+                    get_gemini_clients(api_key)   # per-key clients; nothing process-global is changed
+                    st.session_state.api_key = api_key
                     st.session_state.api_key_set = True
                     st.session_state.api_key_status = "ok"
                 except Exception as e:
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import streamlit as st
+
+# ---------------------------
+# Change feed for submissions
+# ---------------------------
+# Subscribers get callback(event_type, row) with event_type INSERT, UPDATE or DELETE.
+# LocalSubmissionFeed is an in-process pub/sub: writes made through supabase_client
+# are published to it directly, which also makes it the stand-in for tests.
+# RealtimeSubmissionFeed adds Supabase Realtime (postgres_changes on submissions),
+# so writes from other processes are pushed too.
+#
+# Events carry the auth scope of the client that saw the row. Rows seen anonymously
+# (inserts, Realtime pushes on the anon key) reach every subscriber; rows read back
+# under an admin's session only reach subscribers with that same scope, so a view
+# built for one identity never receives rows another identity's RLS let through.
+
+logger = logging.getLogger(__name__)
+
+ChangeCallback = Callable[[str, Dict[str, Any]], None]
+
+ANON_SCOPE = "anon"
+
+
+class LocalSubmissionFeed:
+    """In-process pub/sub for submission changes."""
+
+    def __init__(self):
+        self._subscribers: List[Tuple[ChangeCallback, Optional[str]]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self) -> bool:
+        """True while every change is guaranteed to reach subscribers."""
+        return False   # only sees writes made by this process
+
+    def subscribe(self, callback: ChangeCallback, scope: Optional[str] = None) -> Callable[[], None]:
+        """Register callback for changes visible to scope (None: every change).
+        Returns a function that unsubscribes it."""
+        entry = (callback, scope)
+        with self._lock:
+            self._subscribers.append(entry)
+        def unsubscribe():
+            with self._lock:
+                if entry in self._subscribers:
+                    self._subscribers.remove(entry)
+        return unsubscribe
+
+    def publish(self, event_type: str, row: Dict[str, Any], scope: str = ANON_SCOPE) -> None:
+        with self._lock:
+            subscribers = [callback for callback, wanted in self._subscribers
+                           if wanted is None or scope in (ANON_SCOPE, wanted)]
+        for callback in subscribers:
+            try:
+                callback(event_type, row)
+            except Exception:
+                logger.exception("submission feed subscriber failed")
+
+
+class RealtimeSubmissionFeed(LocalSubmissionFeed):
+    """Relays Supabase Realtime changes on the submissions table to local subscribers."""
+
+    def __init__(self, url: str, key: str):
+        super().__init__()
+        self._url = f"{url.rstrip('/')}/realtime/v1"
+        self._key = key
+        self._connected = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="submission-realtime", daemon=True)
+        self._thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def _run(self) -> None:
+        from realtime import AsyncRealtimeClient, RealtimePostgresChangesListenEvent, RealtimeSubscribeStates
+
+        def on_state(state, error):
+            if state == RealtimeSubscribeStates.SUBSCRIBED:
+                self._connected.set()
+            else:
+                self._connected.clear()
+                if error:
+                    logger.warning("submissions realtime channel: %s (%s)", state, error)
+
+        def on_change(payload):
+            data = payload.get("data", {})
+            event_type = str(getattr(data.get("type"), "value", data.get("type")))
+            row = data.get("old_record") if event_type == "DELETE" else data.get("record")
+            if row:
+                self.publish(event_type, row)
+
+        async def connect():
+            client = AsyncRealtimeClient(self._url, token=self._key)
+            await client.connect()
+            channel = client.channel("submissions-feed")
+            channel.on_postgres_changes(RealtimePostgresChangesListenEvent.All, schema="public", table="submissions", callback=on_change)
+            await channel.subscribe(on_state)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(connect())
+            loop.run_forever()
+        except Exception:
+            logger.exception("submissions realtime feed stopped; falling back to polling")
+            self._connected.clear()
+
+
+@st.cache_resource(show_spinner=False)
+def get_submission_feed() -> LocalSubmissionFeed:
+    """Process-wide feed. Set SUPABASE_REALTIME = false in secrets to use the local feed only."""
+    if str(st.secrets.get("STORAGE_BACKEND", "supabase")).lower() != "supabase" \
+            or str(st.secrets.get("SUPABASE_REALTIME", "true")).lower() == "false":
+        return LocalSubmissionFeed()
+    return RealtimeSubmissionFeed(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_ANON_KEY"])
+
+def publish_changes(event_type: str, rows: List[Dict[str, Any]], scope: str = ANON_SCOPE) -> None:
+    """Publish rows written by this process, as read back under scope.
+    Never raises, so a write can't fail because of it."""
+    try:
+        feed = get_submission_feed()
+    except Exception:
+        return
+    for row in rows:
+        feed.publish(event_type, row, scope)
@@ -0,0 +1,139 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Callable, Optional
+
+import streamlit as st
+from storage import get_storage, SUBMISSION_LIST_COLUMNS
+from submission_feed import get_submission_feed
+
+# ---------------------------
+# Local materialized copy of submissions for the admin dashboard
+# ---------------------------
+# The first sync pulls every row once per process. After that, each sync only
+# asks for rows whose updated_at is at or after the watermark, so a refresh costs
+# time proportional to new or changed submissions. While the change feed is
+# connected, pushed rows are merged as they arrive and reruns skip the delta query.
+# Reads run under the session's row-level security, so there is one mirror per auth
+# scope (anonymous, or each signed-in admin) rather than one per process.
+
+MIN_SYNC_INTERVAL_SEC = 2.0   # reruns from many admin sessions share one delta query
+SYNC_OVERLAP_SEC = 5.0        # re-read a few seconds back to catch late-committing writes
+
+
+def _parse_ts(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class SubmissionMirror:
+    """Rows keyed by id plus a per-student index, kept current by delta sync and the change feed."""
+
+    def __init__(self, columns: str = SUBMISSION_LIST_COLUMNS, is_live: Callable[[], bool] = lambda: False):
+        self.columns = columns
+        self._keep = {c.strip() for c in columns.split(",")} | {"id", "created_at", "updated_at"}
+        self._is_live = is_live
+        self._rows: Dict[Any, Dict[str, Any]] = {}
+        self._by_student: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        self._watermark: Optional[str] = None
+        self._last_sync = 0.0
+        self._lock = threading.RLock()
+        self.last_delta = 0
+        self.version = 0                               # bumped on every merged change
+        self._changed_at: Dict[str, int] = {}          # student_name -> version of last change
+
+    def sync(self, force: bool = False) -> int:
+        """Pull changes since the watermark and merge them. Returns rows merged."""
+        with self._lock:
+            if not force and time.monotonic() - self._last_sync < MIN_SYNC_INTERVAL_SEC:
+                return 0
+            if not force and self._watermark is not None and self._is_live():
+                return 0   # pushed changes are already merged
+            since = None
+            if self._watermark is not None:
+                since = (_parse_ts(self._watermark) - timedelta(seconds=SYNC_OVERLAP_SEC)).isoformat()
+            merged, cursor = 0, None
+            while True:
+                page = get_storage().get_submissions_changed_since(since, self.columns, cursor=cursor)
+                for row in page["rows"]:
+                    self._merge(row)
+                merged += len(page["rows"])
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            self._last_sync = time.monotonic()
+            self.last_delta = merged
+            return merged
+
+    def apply_change(self, event_type: str, row: Dict[str, Any]) -> None:
+        """Change-feed callback: merge a pushed INSERT/UPDATE, drop a DELETE."""
+        with self._lock:
+            if event_type == "DELETE":
+                old = self._rows.pop(row.get("id"), None)
+                if old is not None:
+                    self._by_student.get(old["student_name"], {}).pop(old["id"], None)
+                    self._touch(old["student_name"])
+            elif "id" in row and "student_name" in row:
+                self._merge({k: v for k, v in row.items() if k in self._keep})
+
+    def changed_since(self, version: int) -> List[str]:
+        """Students whose rows changed after the given version."""
+        with self._lock:
+            return [name for name, v in self._changed_at.items() if v > version]
+
+    def _touch(self, student_name: str) -> None:
+        self.version += 1
+        self._changed_at[student_name] = self.version
+
+    def _merge(self, row: Dict[str, Any]) -> None:
+        old = self._rows.get(row["id"])
+        if old is not None and old["student_name"] != row["student_name"]:
+            self._by_student.get(old["student_name"], {}).pop(row["id"], None)
+        merged = {**old, **row} if old else row
+        if merged == old:
+            return
+        self._rows[row["id"]] = merged
+        self._by_student.setdefault(row["student_name"], {})[row["id"]] = merged
+        self._touch(row["student_name"])
+        updated_at = row.get("updated_at")
+        if updated_at and (self._watermark is None or _parse_ts(updated_at) > _parse_ts(self._watermark)):
+            self._watermark = updated_at
+
+    def student_summaries(self) -> List[Dict[str, Any]]:
+        """Same shape as supabase_client.get_student_summaries(), built from the local copy."""
+        with self._lock:
+            summaries = []
+            for name, rows in self._by_student.items():
+                if not rows:
+                    continue
+                latest = max(rows.values(), key=lambda r: (r["created_at"], str(r["id"])))
+                summaries.append({
+                    "student_name": name,
+                    "submission_count": len(rows),
+                    "latest_created_at": latest["created_at"],
+                    "latest_grade_status": "graded" if latest.get("grade_json") else "ungraded",
+                })
+        summaries.sort(key=lambda s: s["latest_created_at"], reverse=True)
+        return summaries
+
+    def submissions_for(self, student_name: str) -> List[Dict[str, Any]]:
+        """A student's submissions, newest first (copies, safe to modify)."""
+        with self._lock:
+            rows = [dict(r) for r in self._by_student.get(student_name, {}).values()]
+        rows.sort(key=lambda r: (r["created_at"], str(r["id"])), reverse=True)
+        return rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_scoped_mirror(scope: str) -> SubmissionMirror:
+    feed = get_submission_feed()
+    mirror = SubmissionMirror(is_live=lambda: feed.connected)
+    feed.subscribe(mirror.apply_change, scope)
+    return mirror
+
+def get_submission_mirror() -> SubmissionMirror:
+    """The mirror for this session's auth scope, shared by every session with that scope
+    and fed by the change feed. Sync it from a session with the same scope."""
+    return _get_scoped_mirror(get_storage().auth_scope())
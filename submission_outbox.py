@@ -0,0 +1,161 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Dict, Any, Callable, Optional
+
+import streamlit as st
+
+# ---------------------------
+# Durable write-behind queue for student submissions
+# ---------------------------
+# Submissions are journaled to a local SQLite (WAL) outbox first, so a slow or
+# unavailable Supabase never blocks or loses a student's answer. A background
+# flusher batch-inserts journaled rows into the storage backend; every row carries
+# an idempotency_key so a retried batch can't create duplicates (see sql/submission_outbox.sql).
+
+DEFAULT_OUTBOX_PATH = os.path.join(".data", "submission_outbox.db")
+FLUSH_BATCH_SIZE = 50
+FLUSH_IDLE_SEC = 2.0           # how often the flusher checks for due rows when idle
+RETRY_BASE_SEC = 1.0
+RETRY_MAX_SEC = 120.0
+MAX_ATTEMPTS = 12              # after this a row is parked as 'dead' (kept, not dropped)
+
+_SCHEMA = """
+create table if not exists outbox (
+    idempotency_key text primary key,
+    payload         text not null,
+    created_at      real not null,
+    attempts        integer not null default 0,
+    next_attempt_at real not null,
+    last_error      text,
+    status          text not null default 'pending'   -- pending | dead
+)
+"""
+
+def _connect(path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("pragma journal_mode=wal")
+    conn.execute("pragma synchronous=full")   # a journaled row survives a crash or power loss
+    conn.execute(_SCHEMA)
+    return conn
+
+def _backoff(attempts: int) -> float:
+    """Capped exponential backoff with full jitter."""
+    return random.uniform(0, min(RETRY_MAX_SEC, RETRY_BASE_SEC * (2 ** attempts)))
+
+
+class SubmissionOutbox:
+    """SQLite-backed outbox plus the background thread that drains it."""
+
+    def __init__(self, path: str, insert_batch: Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]):
+        self.path = path
+        self._insert_batch = insert_batch
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        _connect(path).close()
+        self._thread = threading.Thread(target=self._run, name="submission-outbox", daemon=True)
+        self._thread.start()
+
+    # ----- producer side -----
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        """Journal a submission and return its idempotency key once it is on disk."""
+        key = payload.get("idempotency_key") or uuid.uuid4().hex
+        payload = {**payload, "idempotency_key": key}
+        now = time.time()
+        conn = _connect(self.path)
+        try:
+            conn.execute(
+                "insert or ignore into outbox (idempotency_key, payload, created_at, next_attempt_at) values (?, ?, ?, ?)",
+                (key, json.dumps(payload), now, now),
+            )
+        finally:
+            conn.close()
+        self._wake.set()
+        return key
+
+    def stats(self) -> Dict[str, int]:
+        conn = _connect(self.path)
+        try:
+            rows = conn.execute("select status, count(*) from outbox group by status").fetchall()
+        finally:
+            conn.close()
+        counts = {"pending": 0, "dead": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    # ----- flusher side -----
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                flushed = self.flush_once()
+            except Exception:
+                flushed = 0
+            if not flushed:
+                self._wake.wait(FLUSH_IDLE_SEC)
+                self._wake.clear()
+
+    def flush_once(self) -> int:
+        """Send one batch of due rows. Returns how many rows were delivered."""
+        conn = _connect(self.path)
+        try:
+            due = conn.execute(
+                "select idempotency_key, payload, attempts from outbox "
+                "where status = 'pending' and next_attempt_at <= ? order by created_at limit ?",
+                (time.time(), FLUSH_BATCH_SIZE),
+            ).fetchall()
+            if not due:
+                return 0
+            try:
+                self._insert_batch([json.loads(p) for _, p, _ in due])
+                delivered = [key for key, _, _ in due]
+            except Exception:
+                # Send rows one at a time so one bad row can't hold back the rest
+                delivered = []
+                for key, payload, attempts in due:
+                    try:
+                        self._insert_batch([json.loads(payload)])
+                        delivered.append(key)
+                    except Exception as e:
+                        self._mark_failed(conn, key, attempts + 1, str(e))
+            conn.executemany("delete from outbox where idempotency_key = ?", [(k,) for k in delivered])
+            return len(delivered)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _mark_failed(conn: sqlite3.Connection, key: str, attempts: int, error: str) -> None:
+        status = "dead" if attempts >= MAX_ATTEMPTS else "pending"
+        conn.execute(
+            "update outbox set attempts = ?, next_attempt_at = ?, last_error = ?, status = ? where idempotency_key = ?",
+            (attempts, time.time() + _backoff(attempts), error, status, key),
+        )
+
+
+@st.cache_resource(show_spinner=False)
+def _get_outbox(path: str) -> SubmissionOutbox:
+    from storage import get_storage
+    return SubmissionOutbox(path, get_storage().insert_submissions_batch)
+
+def get_outbox() -> SubmissionOutbox:
+    return _get_outbox(st.secrets.get("SUBMISSION_OUTBOX_PATH", DEFAULT_OUTBOX_PATH))
+
+def submit_submission(payload: Dict[str, Any]) -> str:
+    """Journal a submission for background delivery to storage; returns its idempotency key."""
+    return get_outbox().enqueue(payload)
+
+def outbox_stats() -> Optional[Dict[str, int]]:
+    try:
+        return get_outbox().stats()
+    except Exception:
+        return None
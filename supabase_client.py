@@ -1,14 +1,120 @@
-from typing import List, Dict, Any
+import copy
+import time
+from typing import List, Dict, Any, Optional
+import httpx
 import streamlit as st
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from query_cache import QueryCache
+from submission_feed import ANON_SCOPE, publish_changes
+from storage import SUBMISSION_LIST_COLUMNS, DEFAULT_PAGE_SIZE, Cursor
 
 # ---------------------------
 # Supabase Client Setup
 # ---------------------------
-def get_client() -> Client:
+# Pool limits and timeouts can be overridden in .streamlit/secrets.toml
+DEFAULT_POOL_MAX_CONNECTIONS = 50
+DEFAULT_POOL_MAX_KEEPALIVE = 20
+DEFAULT_POOL_KEEPALIVE_EXPIRY = 30.0   # seconds an idle connection stays open
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_REQUEST_TIMEOUT = 30.0
+
+def _setting(name: str, default):
+    """Read an optional numeric setting from st.secrets, falling back to default."""
+    try:
+        return type(default)(st.secrets.get(name, default))
+    except Exception:
+        return default
+
+@st.cache_resource(show_spinner=False)
+def _get_http_pool(max_connections: int, max_keepalive: int, keepalive_expiry: float,
+                   connect_timeout: float, request_timeout: float) -> httpx.Client:
+    """One keep-alive HTTP connection pool per process, shared by every Supabase client."""
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(request_timeout, connect=connect_timeout),
+        follow_redirects=True,
+        http2=True,
+    )
+
+def _pool() -> httpx.Client:
+    return _get_http_pool(
+        _setting("SUPABASE_POOL_MAX_CONNECTIONS", DEFAULT_POOL_MAX_CONNECTIONS),
+        _setting("SUPABASE_POOL_MAX_KEEPALIVE", DEFAULT_POOL_MAX_KEEPALIVE),
+        _setting("SUPABASE_POOL_KEEPALIVE_EXPIRY", DEFAULT_POOL_KEEPALIVE_EXPIRY),
+        _setting("SUPABASE_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+        _setting("SUPABASE_REQUEST_TIMEOUT", DEFAULT_REQUEST_TIMEOUT),
+    )
+
+def _new_client() -> Client:
+    """A client with its own auth state that still reuses the shared connection pool."""
     url = st.secrets["SUPABASE_URL"]
     key = st.secrets["SUPABASE_ANON_KEY"]
-    return create_client(url, key)
+    return create_client(url, key, options=ClientOptions(httpx_client=_pool()))
+
+@st.cache_resource(show_spinner=False)
+def _get_shared_client(url: str, key: str) -> Client:
+    return _new_client()
+
+def get_client() -> Client:
+    """Process-wide anonymous client. Do not sign in on it; auth uses its own clients."""
+    return _get_shared_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_ANON_KEY"])
+
+def _admin_session():
+    """(client, auth scope) for this session: the signed-in admin's, else the shared anonymous one."""
+    try:
+        sb = st.session_state.get("supabase_admin_client")
+        user_id = st.session_state.get("supabase_admin_user_id")
+    except Exception:   # no script run context, e.g. a background thread
+        sb = None
+    if sb is None:
+        return get_client(), ANON_SCOPE
+    return sb, f"user:{user_id}"
+
+def get_admin_client() -> Client:
+    """The signed-in admin's client for this session (RLS-scoped), else the shared anonymous one."""
+    return _admin_session()[0]
+
+def auth_scope() -> str:
+    """Whose permissions get_admin_client() reads with: "anon" or "user:<id>"."""
+    return _admin_session()[1]
+
+def reset_client() -> None:
+    """Drop the pooled client and connections so the next call reconnects."""
+    _get_shared_client.clear()
+    _get_http_pool.clear()
+
+def check_health() -> Dict[str, Any]:
+    """Run a one-row query through the pooled client and report latency."""
+    started = time.perf_counter()
+    try:
+        get_client().table("submissions").select("id").limit(1).execute()
+        return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        return {"ok": False, "latency_ms": round((time.perf_counter() - started) * 1000, 1), "error": str(e)}
+
+# ---------------------------
+# Shared read cache (all sessions in this process)
+# ---------------------------
+SUBMISSIONS_CACHE_TTL_SEC = 30
+_submissions_cache = QueryCache(SUBMISSIONS_CACHE_TTL_SEC)
+
+def _cached(key, fetch):
+    """fetch(client) through the shared cache. The key is scoped to the caller's identity,
+    since RLS gives each identity its own view of the table."""
+    sb, scope = _admin_session()
+    # Callers get their own copy, so patching rows in session state can't leak to other sessions
+    return copy.deepcopy(_submissions_cache.get_or_fetch((scope,) + key, lambda: fetch(sb)))
+
+def invalidate_submissions_cache() -> None:
+    """Call after any write to submissions so every session refetches."""
+    _submissions_cache.invalidate()
+
+def submissions_cache_stats() -> Dict[str, int]:
+    return _submissions_cache.stats()
 
 # ---------------------------
 # Submissions (Only Blossom)
@@ -29,6 +135,19 @@ def get_submissions() -> List[Dict[str, Any]]:
 def insert_submission(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
     sb = get_client()
     res = sb.table("submissions").insert(payload).execute()
+    invalidate_submissions_cache()
+    publish_changes("INSERT", res.data or [])
+    return res.data or []
+
+def insert_submissions_batch(payloads: List[Dict[str, Any]], sb: Optional[Client] = None) -> List[Dict[str, Any]]:
+    """Insert many submissions in one request. Rows whose idempotency_key already
+    exists are skipped, so a retried batch never duplicates a submission."""
+    sb = sb or get_client()
+    res = sb.table("submissions") \
+        .upsert(payloads, on_conflict="idempotency_key", ignore_duplicates=True) \
+        .execute()
+    invalidate_submissions_cache()
+    publish_changes("INSERT", res.data or [])
     return res.data or []
     
 def get_all_submissions() -> List[Dict[str, Any]]:
@@ -36,6 +155,145 @@ def get_all_submissions() -> List[Dict[str, Any]]:
     res = sb.table("submissions").select("*").order("created_at", desc=True).execute()
     return res.data or []
 
+# ---------------------------
+# Paged submissions (admin pages)
+# ---------------------------
+def _after_cursor(cursor: Cursor) -> str:
+    """PostgREST or-filter for rows strictly after cursor in (created_at desc, id desc) order."""
+    created_at, row_id = cursor
+    return f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{row_id}")'
+
+def get_submissions_page(columns: str = SUBMISSION_LIST_COLUMNS,
+                         page_size: int = DEFAULT_PAGE_SIZE,
+                         cursor: Optional[Cursor] = None,
+                         student_name: Optional[str] = None) -> Dict[str, Any]:
+    """Return one page of submissions, newest first, using a (created_at, id) keyset cursor.
+
+    If student_name is given, only that student's submissions are paged.
+
+    Result: {"rows": [...], "next_cursor": Cursor or None}. Pass next_cursor back to get
+    the following page; None means there are no more rows. Served from the shared cache.
+    """
+    return _cached(("page", columns, page_size, cursor, student_name),
+                   lambda sb: _fetch_submissions_page(sb, columns, page_size, cursor, student_name))
+
+def _fetch_submissions_page(sb: Client, columns: str, page_size: int, cursor: Optional[Cursor],
+                            student_name: Optional[str]) -> Dict[str, Any]:
+    names = {c.strip() for c in columns.split(",")}
+    if "*" not in names:
+        # The cursor is built from these two columns, so always fetch them
+        columns = ", ".join([columns] + [c for c in ("id", "created_at") if c not in names])
+    query = sb.table("submissions").select(columns)
+    if student_name is not None:
+        query = query.eq("student_name", student_name)
+    if cursor is not None:
+        query = query.or_(_after_cursor(cursor))
+    # Ask for one extra row so we know whether another page exists
+    res = query.order("created_at", desc=True).order("id", desc=True).limit(page_size + 1).execute()
+    rows = res.data or []
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]["created_at"], rows[-1]["id"])
+    return {"rows": rows, "next_cursor": next_cursor}
+
+def get_submissions_changed_since(since: Optional[str] = None,
+                                  columns: str = SUBMISSION_LIST_COLUMNS,
+                                  page_size: int = 500,
+                                  cursor: Optional[Cursor] = None) -> Dict[str, Any]:
+    """Rows inserted or updated at/after `since`, oldest change first (for delta sync).
+
+    Needs the updated_at column from sql/submissions_updated_at.sql. Pages with an
+    ascending (updated_at, id) cursor; result shape matches get_submissions_page.
+    """
+    names = {c.strip() for c in columns.split(",")}
+    if "*" not in names:
+        columns = ", ".join([columns] + [c for c in ("id", "updated_at") if c not in names])
+    query = get_admin_client().table("submissions").select(columns)
+    if cursor is not None:
+        updated_at, row_id = cursor
+        query = query.or_(f'updated_at.gt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt."{row_id}")')
+    elif since is not None:
+        query = query.gte("updated_at", since)
+    res = query.order("updated_at").order("id").limit(page_size + 1).execute()
+    rows = res.data or []
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = (rows[-1]["updated_at"], rows[-1]["id"])
+    return {"rows": rows, "next_cursor": next_cursor}
+
+def count_submissions() -> int:
+    """Total number of submissions without transferring any rows."""
+    def fetch(sb):
+        res = sb.table("submissions").select("id", count="exact", head=True).execute()
+        return res.count or 0
+    return _cached(("count",), fetch)
+
+# ---------------------------
+# Bulk grade updates
+# ---------------------------
+def bulk_update_grades(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Save many grades in one upsert.
+
+    rows: [{"id", "student_name", "grade_json"}, ...] for existing submissions.
+    Returns {"updated": {id: saved_row}, "failed": {id: error_message}}.
+    If the bulk request fails, rows are retried one by one so each failure is reported
+    against the row that caused it.
+    """
+    if not rows:
+        return {"updated": {}, "failed": {}}
+    sb, scope = _admin_session()
+    updated, failed = {}, {}
+    try:
+        # default_to_null=False leaves columns we don't send untouched
+        res = sb.table("submissions") \
+            .upsert(rows, on_conflict="id", default_to_null=False) \
+            .execute()
+        updated = {r["id"]: r for r in (res.data or [])}
+    except Exception as bulk_error:
+        for row in rows:
+            try:
+                res = sb.table("submissions") \
+                    .update({"grade_json": row["grade_json"]}) \
+                    .eq("id", row["id"]) \
+                    .execute()
+                if res.data:
+                    updated[row["id"]] = res.data[0]
+            except Exception as e:
+                failed[row["id"]] = str(e) or str(bulk_error)
+    for row in rows:
+        if row["id"] not in updated and row["id"] not in failed:
+            failed[row["id"]] = "No row returned. Check RLS/policies."
+    if updated:
+        invalidate_submissions_cache()
+        publish_changes("UPDATE", list(updated.values()), scope)
+    return {"updated": updated, "failed": failed}
+
+def update_grade(submission_id: Any, grade: Any) -> List[Dict[str, Any]]:
+    """Overwrite one submission's grade_json."""
+    sb, scope = _admin_session()
+    res = sb.table("submissions") \
+        .update({"grade_json": grade}) \
+        .eq("id", submission_id) \
+        .execute()
+    invalidate_submissions_cache()
+    publish_changes("UPDATE", res.data or [], scope)
+    return res.data or []
+
+# ---------------------------
+# Per-student summary (view defined in sql/student_submission_summary.sql)
+# ---------------------------
+def get_student_summaries() -> List[Dict[str, Any]]:
+    """One row per student: submission_count, latest_created_at, latest_grade_status."""
+    def fetch(sb):
+        res = sb.table("student_submission_summary") \
+            .select("student_name, submission_count, latest_created_at, latest_grade_status") \
+            .order("latest_created_at", desc=True) \
+            .execute()
+        return res.data or []
+    return _cached(("summaries",), fetch)
+
 # ---------------------------
 # Assignment Editor (Optional)
 # ---------------------------
@@ -49,7 +307,7 @@ def upsert_assignment(payload: Dict[str, Any]) -> Dict[str, Any]:
 # Auth
 # ---------------------------
 def sign_up(email: str, password: str):
-    sb = get_client()
+    sb = _new_client()
     try:
         user = sb.auth.sign_up({"email": email, "password": password})
         return user
@@ -58,18 +316,29 @@ def sign_up(email: str, password: str):
         return None
 
 def sign_in(email: str, password: str):
-    sb = get_client()
+    """Sign in on a fresh client and keep it for this session. Its auth client refreshes
+    the access token on a timer before it expires, so later page loads don't re-auth."""
+    sb = _new_client()
     try:
         user = sb.auth.sign_in_with_password({"email": email, "password": password})
+        if user and user.session:
+            st.session_state.supabase_admin_client = sb
+            st.session_state.supabase_admin_user_id = user.user.id
         return user
     except Exception as e:
         st.error(f"Login failed: {e}")
         return None
 
+def end_admin_session():
+    """Sign out the cached admin client (stopping its refresh timer) and forget it."""
+    sb = st.session_state.pop("supabase_admin_client", None)
+    st.session_state.pop("supabase_admin_user_id", None)
+    if sb is not None:
+        sb.auth.sign_out()
+
 def sign_out():
-    sb = get_client()
     try:
-        sb.auth.sign_out()
+        end_admin_session()
         st.session_state.user_email = None
         st.rerun()
     except Exception as e:
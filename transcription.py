@@ -0,0 +1,371 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+import streamlit as st
+from audio_preprocess import mono_samples, preprocess_wav
+from gemini_clients import get_gemini_clients, key_fingerprint
+
+# ---------------------------
+# Gemini transcription helpers
+# ---------------------------
+TRANSCRIBE_MODEL = 'models/gemini-1.5-flash-latest'
+TRANSCRIBE_PROMPT = "Transcribe the given audio accurately. Provide only the spoken text."
+
+# Checkpoints ask for the transcript and the nudge in one structured request instead
+# of transcribing and then re-sending the transcript in a second, text-only call.
+CHECKPOINT_PROMPT = """Return a JSON object with two fields.
+"transcript": transcribe the given audio accurately; only the spoken text.
+"nudge": follow the instructions below, reading the earlier reflection together with what is said in the audio.
+
+{instructions}"""
+CHECKPOINT_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {"transcript": {"type": "string"}, "nudge": {"type": "string"}},
+        "required": ["transcript", "nudge"],
+    },
+}
+
+logger = logging.getLogger(__name__)
+
+# Clips up to this size go inline with the request (Gemini caps a whole request at
+# 20 MB, and inline bytes grow by a third when base64-encoded). Bigger clips use
+# the File API, whose processing state is polled with capped, jittered backoff.
+INLINE_AUDIO_MAX_BYTES = 12 * 1024 * 1024
+UPLOAD_POLL_BASE_SEC = 0.25
+UPLOAD_POLL_MAX_SEC = 5.0
+UPLOAD_PROCESSING_TIMEOUT_SEC = 300.0
+
+# ---------------------------
+# Audio preprocessing (see audio_preprocess.py)
+# ---------------------------
+# WAV clips are shrunk before they are sent. Clips above PREPROCESS_IN_PROCESS_MAX_BYTES
+# are processed in a small process pool so a long recording can't hold the GIL that
+# every other session's script thread needs. AUDIO_CODEC in secrets picks wav/flac/ogg.
+
+PREPROCESS_IN_PROCESS_MAX_BYTES = 2 * 1024 * 1024
+PREPROCESS_WORKERS = 2
+
+@st.cache_resource(show_spinner=False)
+def _get_preprocess_pool() -> ProcessPoolExecutor:
+    import multiprocessing
+    # spawn: forking a process that runs Streamlit's threads is unsafe
+    return ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def _audio_codec() -> str:
+    try:
+        return str(st.secrets.get("AUDIO_CODEC", "wav")).lower()
+    except Exception:
+        return "wav"
+
+def prepare_audio(wav_bytes: bytes) -> Tuple[bytes, str, Dict[str, Any]]:
+    """Preprocess a WAV clip for upload; returns (audio_bytes, mime_type, stats)."""
+    codec = _audio_codec()
+    if len(wav_bytes) <= PREPROCESS_IN_PROCESS_MAX_BYTES:
+        return preprocess_wav(wav_bytes, codec=codec)
+    return _get_preprocess_pool().submit(preprocess_wav, wav_bytes, codec=codec).result()
+
+# ---------------------------
+# Content-addressed transcript cache
+# ---------------------------
+# Keyed by SHA-256 of (model, audio bytes). Transcripts can be shared by everyone
+# and optionally spill to disk. Uploaded file handles belong to the API key that
+# uploaded them, so they are also keyed by a fingerprint of that key, kept in
+# memory only, and dropped before Gemini deletes the file (48 hours).
+
+TRANSCRIPT_CACHE_MAX_ENTRIES = 512
+TRANSCRIPT_CACHE_MAX_DISK_FILES = 5000
+UPLOAD_HANDLE_TTL_SEC = 46 * 3600
+
+def audio_cache_key(audio_bytes: bytes, model_name: str = TRANSCRIBE_MODEL) -> str:
+    h = hashlib.sha256(model_name.encode())
+    h.update(b"\0")
+    h.update(audio_bytes)
+    return h.hexdigest()
+
+
+class TranscriptCache:
+    """Bounded LRU of transcripts (optional on-disk tier) and recent upload handles."""
+
+    def __init__(self, max_entries: int = TRANSCRIPT_CACHE_MAX_ENTRIES, disk_dir: Optional[str] = None,
+                 max_disk_files: int = TRANSCRIPT_CACHE_MAX_DISK_FILES):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_files = max_disk_files
+        self._transcripts: "OrderedDict[str, str]" = OrderedDict()
+        self._uploads: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.txt")
+
+    def get_transcript(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._transcripts:
+                self._transcripts.move_to_end(key)
+                self.hits += 1
+                return self._transcripts[key]
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            with open(self._disk_path(key), encoding="utf-8") as f:
+                text = f.read()
+            os.utime(self._disk_path(key))   # keep recently used files off the eviction list
+            self._remember(key, text)
+            with self._lock:
+                self.hits += 1
+            return text
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put_transcript(self, key: str, text: str) -> None:
+        self._remember(key, text)
+        if self.disk_dir:
+            with open(self._disk_path(key), "w", encoding="utf-8") as f:
+                f.write(text)
+            self._trim_disk()
+
+    def _remember(self, key: str, text: str) -> None:
+        with self._lock:
+            self._transcripts[key] = text
+            self._transcripts.move_to_end(key)
+            while len(self._transcripts) > self.max_entries:
+                self._transcripts.popitem(last=False)
+
+    def _trim_disk(self) -> None:
+        files = [os.path.join(self.disk_dir, n) for n in os.listdir(self.disk_dir) if n.endswith(".txt")]
+        if len(files) <= self.max_disk_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_disk_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_upload(self, key: str, owner: str):
+        with self._lock:
+            entry = self._uploads.get((key, owner))
+            if entry is None:
+                return None
+            if time.time() - entry[0] > UPLOAD_HANDLE_TTL_SEC:
+                del self._uploads[(key, owner)]
+                return None
+            self._uploads.move_to_end((key, owner))
+            return entry[1]
+
+    def put_upload(self, key: str, owner: str, audio_file) -> None:
+        with self._lock:
+            self._uploads[(key, owner)] = (time.time(), audio_file)
+            while len(self._uploads) > self.max_entries:
+                self._uploads.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._transcripts)}
+
+
+@st.cache_resource(show_spinner=False)
+def _get_transcript_cache(disk_dir: Optional[str]) -> TranscriptCache:
+    return TranscriptCache(disk_dir=disk_dir)
+
+def get_transcript_cache() -> TranscriptCache:
+    """Process-wide cache; set TRANSCRIPT_CACHE_DIR in secrets to enable the disk tier."""
+    try:
+        disk_dir = st.secrets.get("TRANSCRIPT_CACHE_DIR")
+    except Exception:
+        disk_dir = None
+    return _get_transcript_cache(disk_dir)
+
+def _upload_and_wait(clients, audio_bytes: bytes, mime_type: str):
+    """Upload through the File API and poll until Gemini has processed the file."""
+    audio_file = clients.upload_file(audio_bytes, mime_type)
+    deadline = time.monotonic() + UPLOAD_PROCESSING_TIMEOUT_SEC
+    attempt = 0
+    while getattr(audio_file, "state", None) and getattr(audio_file.state, "name", "") == "PROCESSING":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Audio upload still processing after {UPLOAD_PROCESSING_TIMEOUT_SEC:.0f}s")
+        delay = min(UPLOAD_POLL_MAX_SEC, UPLOAD_POLL_BASE_SEC * (2 ** attempt))
+        time.sleep(min(remaining, random.uniform(delay / 2, delay)))
+        attempt += 1
+        audio_file = clients.get_file(audio_file.name)
+    if getattr(getattr(audio_file, "state", None), "name", "") == "FAILED":
+        raise RuntimeError("Gemini could not process the uploaded audio")
+    return audio_file
+
+def _audio_part(cache: TranscriptCache, key: str, audio_bytes: bytes, mime_type: str,
+                api_key: Optional[str], report: Optional[Dict[str, Any]]):
+    """(clients, part) ready for generate_content, or None if the audio is all silence."""
+    if mime_type == "audio/wav":
+        audio_bytes, mime_type, stats = prepare_audio(audio_bytes)
+        if report is not None:
+            report.update(stats)
+        if stats["output_sec"] == 0:
+            return None
+
+    clients = get_gemini_clients(api_key)
+    if len(audio_bytes) <= INLINE_AUDIO_MAX_BYTES:
+        return clients, {"mime_type": mime_type, "data": audio_bytes}
+    owner = key_fingerprint(api_key)
+    audio_file = cache.get_upload(key, owner)
+    if audio_file is None:
+        audio_file = _upload_and_wait(clients, audio_bytes, mime_type)
+        cache.put_upload(key, owner, audio_file)
+    return clients, audio_file
+
+def _plain_transcript(cache: TranscriptCache, key: str, clients, audio_part) -> str:
+    response = clients.model(TRANSCRIBE_MODEL).generate_content([audio_part, TRANSCRIBE_PROMPT])
+    text = response.text or ""
+    cache.put_transcript(key, text)
+    return text
+
+def transcribe_audio(audio_bytes: bytes, mime_type: str = "audio/wav", api_key: Optional[str] = None,
+                     report: Optional[Dict[str, Any]] = None) -> str:
+    """Send audio to Gemini and return the transcript text.
+
+    Small clips are sent inline; larger ones are uploaded and polled. Identical audio
+    is answered from the transcript cache without any network call. api_key picks
+    the student's Gemini clients and scopes reuse of uploaded files. WAV input is
+    preprocessed first, and its before/after sizes are written into report if given.
+    """
+    cache = get_transcript_cache()
+    key = audio_cache_key(audio_bytes, TRANSCRIBE_MODEL)
+    cached = cache.get_transcript(key)
+    if cached is not None:
+        return cached
+    prepared = _audio_part(cache, key, audio_bytes, mime_type, api_key, report)
+    if prepared is None:
+        cache.put_transcript(key, "")   # nothing but silence
+        return ""
+    return _plain_transcript(cache, key, *prepared)
+
+def transcribe_with_nudge(audio_bytes: bytes, nudge_instructions: str, mime_type: str = "audio/wav",
+                          api_key: Optional[str] = None,
+                          report: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[str]]:
+    """Transcript and nudge from one request; returns (transcript, nudge).
+
+    nudge is None when there was no fused reply (cached or silent audio) or the reply
+    could not be parsed; the transcript then comes from a plain transcription call and
+    the caller should generate the nudge separately.
+    """
+    cache = get_transcript_cache()
+    key = audio_cache_key(audio_bytes, TRANSCRIBE_MODEL)
+    cached = cache.get_transcript(key)
+    if cached is not None:
+        return cached, None
+    prepared = _audio_part(cache, key, audio_bytes, mime_type, api_key, report)
+    if prepared is None:
+        cache.put_transcript(key, "")
+        return "", None
+
+    clients, audio_part = prepared
+    model = clients.model(TRANSCRIBE_MODEL, generation_config=CHECKPOINT_GENERATION_CONFIG)
+    response = model.generate_content([audio_part, CHECKPOINT_PROMPT.format(instructions=nudge_instructions)])
+    try:
+        data = json.loads(response.text)
+        transcript, nudge = data["transcript"], data["nudge"]
+        if not isinstance(transcript, str) or not isinstance(nudge, str):
+            raise TypeError("transcript and nudge must be strings")
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("checkpoint reply was not usable JSON (%s); falling back to two calls", e)
+        return _plain_transcript(cache, key, clients, audio_part), None
+    cache.put_transcript(key, transcript)
+    return transcript, nudge
+
+# ---------------------------
+# Incremental (checkpoint) transcription
+# ---------------------------
+# Checkpoints only send audio recorded since the last transcribed frame, cut at the
+# quietest point near the end so a word isn't split. The rest is picked up next time.
+
+MIN_NEW_AUDIO_SEC = 1.0       # skip a checkpoint if less new audio than this
+SILENCE_SEARCH_SEC = 2.0      # how far back from the end to look for a pause
+SILENCE_WINDOW_SEC = 0.03     # energy window used to find the pause
+
+def read_wav(wav_bytes: bytes) -> Tuple[wave._wave_params, bytes]:
+    with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+        return w.getparams(), w.readframes(w.getnframes())
+
+def write_wav(params: wave._wave_params, frames: bytes) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(params.nchannels)
+        w.setsampwidth(params.sampwidth)
+        w.setframerate(params.framerate)
+        w.writeframes(frames)
+    return buf.getvalue()
+
+def silence_boundary(params: wave._wave_params, frames: bytes, start: int, end: int) -> int:
+    """Frame index in (start, end] at the quietest window within SILENCE_SEARCH_SEC of end."""
+    window = max(1, int(params.framerate * SILENCE_WINDOW_SEC))
+    search_start = max(start, end - int(params.framerate * SILENCE_SEARCH_SEC))
+    if end - search_start < 2 * window:
+        return end
+    frame_bytes = params.sampwidth * params.nchannels
+    tail = mono_samples(params, frames[search_start * frame_bytes:end * frame_bytes])
+    usable = len(tail) // window * window
+    energy = np.sqrt(np.mean(tail[:usable].reshape(-1, window) ** 2, axis=1))
+    quietest = int(np.argmin(energy))
+    return search_start + quietest * window + window // 2
+
+def transcribe_new_audio(wav_bytes: bytes, recording_id: Any, progress: Dict[str, Any],
+                         final: bool = False, api_key: Optional[str] = None) -> Optional[str]:
+    """Transcript of the audio after progress["frame"]; see checkpoint_new_audio."""
+    return checkpoint_new_audio(wav_bytes, recording_id, progress, final=final, api_key=api_key)[0]
+
+def checkpoint_new_audio(wav_bytes: bytes, recording_id: Any, progress: Dict[str, Any],
+                         final: bool = False, api_key: Optional[str] = None,
+                         nudge_instructions: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """Transcribe only the audio after progress["frame"] and advance progress.
+
+    progress is {"recording_id", "frame"} and is updated in place. A new recording
+    (different id) starts from frame 0. With final=True everything up to the end is
+    sent; otherwise the cut is moved back to a nearby pause. Returns (text, nudge);
+    text is None when there was not enough new audio to be worth a request. A nudge
+    is only requested (in the same call) when nudge_instructions is given; see
+    transcribe_with_nudge. Preprocessing sizes go in progress["last_upload"].
+    """
+    if progress.get("recording_id") != recording_id:
+        progress["recording_id"] = recording_id
+        progress["frame"] = 0
+
+    params, frames = read_wav(wav_bytes)
+    total = len(frames) // (params.sampwidth * params.nchannels)
+    start = min(progress.get("frame", 0), total)
+    if total - start < params.framerate * MIN_NEW_AUDIO_SEC and not (final and total > start):
+        return None, None
+
+    end = total if final else silence_boundary(params, frames, start, total)
+    frame_bytes = params.sampwidth * params.nchannels
+    segment = write_wav(params, frames[start * frame_bytes:end * frame_bytes])
+    report: Dict[str, Any] = {}
+    if nudge_instructions is None:
+        text, nudge = transcribe_audio(segment, "audio/wav", api_key=api_key, report=report), None
+    else:
+        text, nudge = transcribe_with_nudge(segment, nudge_instructions, "audio/wav", api_key=api_key, report=report)
+    progress["frame"] = end
+    if report:
+        progress["last_upload"] = report
+    return text, nudge
+
+def append_transcript(existing: str, new_text: str) -> str:
+    new_text = (new_text or "").strip()
+    if not new_text:
+        return existing
+    return f"{existing.rstrip()} {new_text}".strip()
@@ -0,0 +1,89 @@
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+import streamlit as st
+
+# ---------------------------
+# Background transcription jobs
+# ---------------------------
+# Uploading audio and waiting for Gemini can take tens of seconds. Jobs run on a
+# small process-wide thread pool instead of the script thread; the page keeps only
+# the job id in session_state and polls status, so the student can keep recording
+# and typing while a checkpoint is transcribed. Job functions must not touch
+# st.session_state (there is no script context on pool threads).
+
+DEFAULT_TRANSCRIBE_WORKERS = 4
+MAX_QUEUED_JOBS = 64           # refuse new work rather than queue without limit
+JOB_RETENTION_SEC = 15 * 60    # finished jobs nobody collected are dropped after this
+
+
+class TranscriptionJobs:
+    """Bounded thread pool plus a registry of job futures addressed by id."""
+
+    def __init__(self, max_workers: int = DEFAULT_TRANSCRIBE_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transcribe")
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> str:
+        """Queue fn(*args, **kwargs) and return a job id right away."""
+        with self._lock:
+            self._prune()
+            if sum(1 for j in self._jobs.values() if not j["future"].done()) >= MAX_QUEUED_JOBS:
+                raise RuntimeError("Transcription queue is full; please try again in a moment.")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {"future": self._pool.submit(fn, *args, **kwargs), "submitted_at": time.time()}
+        return job_id
+
+    def status(self, job_id: str) -> str:
+        """One of 'queued', 'running', 'done', 'failed' or 'unknown'."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return "unknown"
+        future: Future = job["future"]
+        if future.running():
+            return "running"
+        if not future.done():
+            return "queued"
+        return "failed" if future.exception() is not None else "done"
+
+    def done(self, job_id: str) -> bool:
+        return self.status(job_id) in ("done", "failed", "unknown")
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """Block up to timeout seconds for a job; True once it has finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return True
+        return bool(wait([job["future"]], timeout=timeout).done)
+
+    def pop_result(self, job_id: str) -> Any:
+        """Remove a finished job and return its result, re-raising its exception."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            raise KeyError("Transcription job not found (the server may have restarted).")
+        return job["future"].result(timeout=0)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_RETENTION_SEC
+        for job_id in [k for k, j in self._jobs.items() if j["future"].done() and j["submitted_at"] < cutoff]:
+            del self._jobs[job_id]
+
+
+@st.cache_resource(show_spinner=False)
+def _get_transcription_jobs(max_workers: int) -> TranscriptionJobs:
+    return TranscriptionJobs(max_workers)
+
+def get_transcription_jobs() -> TranscriptionJobs:
+    """Process-wide job runner; TRANSCRIBE_WORKERS in secrets sets the pool size."""
+    try:
+        workers = int(st.secrets.get("TRANSCRIBE_WORKERS", DEFAULT_TRANSCRIBE_WORKERS))
+    except Exception:
+        workers = DEFAULT_TRANSCRIBE_WORKERS
+    return _get_transcription_jobs(workers)
@@ -1,4 +1,5 @@
 import streamlit as st
+from storage import get_storage, SUBMISSION_LIST_COLUMNS
 
 
 def style_sidebar():
@@ -37,6 +38,7 @@ def create_admin_sidebar():
     st.sidebar.title("Admin Navigation")
     st.sidebar.page_link("pages/admin_home.py", label="🏠 Dashboard")
     st.sidebar.page_link("pages/admin_edit_grades.py", label="✏️ Edit Grades")
+    st.sidebar.page_link("pages/admin_regrade.py", label="🔁 Regrade")
 
 def create_student_view_button():
     top_right = st.columns([8, 2])  # 90% space + 10% button
@@ -50,5 +52,60 @@ def render_admin_logout():
 
     # Logout Button
     if st.sidebar.button("🚪 Log Out", key="logout_admin"):
+        try:
+            get_storage().end_admin_session()
+        except Exception:
+            pass  # the local session is cleared either way
         st.session_state.clear()
-        st.switch_page("student_login.py")  # Or your main student page
\ No newline at end of file
+        st.switch_page("student_login.py")  # Or your main student page
+
+
+# ---------------------------
+# Paged submissions for admin pages
+# ---------------------------
+# Every loaded page lives under one session key, {page_key: {"rows", "next_cursor", ...}},
+# so widget keys can never collide with it
+PAGES_STATE_KEY = "edit_grades_pages"
+
+def _loaded_pages() -> dict:
+    if PAGES_STATE_KEY not in st.session_state:
+        st.session_state[PAGES_STATE_KEY] = {}
+    return st.session_state[PAGES_STATE_KEY]
+
+def loaded_submission_pages():
+    """Paging states currently held in this session."""
+    return [state for state in _loaded_pages().values() if isinstance(state, dict)]
+
+def load_submission_pages(page_key: str, columns: str = SUBMISSION_LIST_COLUMNS, student_name=None):
+    """Rows loaded so far for this page; only the first page is fetched up front."""
+    pages = _loaded_pages()
+    if page_key not in pages:
+        page = get_storage().get_submissions_page(columns, student_name=student_name)
+        pages[page_key] = {
+            "rows": page["rows"],
+            "next_cursor": page["next_cursor"],
+            "columns": columns,
+            "student_name": student_name,
+        }
+    return pages[page_key]["rows"]
+
+def render_load_more(page_key: str):
+    """'Load more' button that appends the next keyset page to the loaded rows."""
+    state = _loaded_pages().get(page_key)
+    if not state or state["next_cursor"] is None:
+        return
+    if st.button("⬇️ Load more submissions", key=f"load_more_submissions:{page_key}"):
+        page = get_storage().get_submissions_page(state["columns"], cursor=state["next_cursor"],
+                                                  student_name=state["student_name"])
+        state["rows"].extend(page["rows"])
+        state["next_cursor"] = page["next_cursor"]
+        st.rerun()
+
+def reset_submission_pages():
+    """Forget loaded pages so admin pages refetch after a grade change."""
+    st.session_state.pop(PAGES_STATE_KEY, None)
+
+def student_label(summary) -> str:
+    """Expander header for a student summary row."""
+    n = summary["submission_count"]
+    return f"👤 {summary['student_name']} ({n} submission{'s' if n != 1 else ''})"